@@ -4,8 +4,18 @@ import time
 import sublime, sublime_plugin
 from . import utils
 from . import core
+from . import stats
+from . import watcher
+from . import outline
 from .dep_graph import DepGraph
 
+def plugin_loaded():
+    utils.watch_settings([core.resize_caches])
+
+def plugin_unloaded():
+    utils.unwatch_settings()
+    watcher.unwatch_all()
+
 class RetValThread(threading.Thread):
     """
     Thread that accepts a `on_complete` callback that gets the return value of the
@@ -20,70 +30,363 @@ class RetValThread(threading.Thread):
         ret = self._target(*self._args, **self._kwargs)
         self._on_complete(ret)
 
-class GotoUsageCommand(sublime_plugin.TextCommand):
+PANEL_REFRESH_INTERVAL = 500
 
-    def run(self, edit):
+class UsagePanel:
+    """
+    Quick panel listing the usages of a search while the search is still running.
+    Opens as soon as the first usages are found and is re-opened with the new ones
+    (keeping the highlighted item) at most every PANEL_REFRESH_INTERVAL ms.
+    Closing the panel cancels the search.
 
-        window = sublime.active_window()
-        project_folders = window.folders()
+    Re-opening the panel resets its filter, so once the user typed into it or moved the
+    selection it's left alone: while the search is running the list ends with a "more
+    results" entry that re-opens the panel with everything found so far, and the status
+    bar tells how many usages that adds.
+
+    A search stopped early by a `core.SearchLimit` ends the list with a "load more" entry
+    which calls `resume(files_done, token)` to search the remaining files.
+    """
+
+    # The panel shown, quick panels are modal so there's at most one
+    active = None
+
+    def __init__(self, view, subject, token, resume = None):
+        self.view = view
+        self.window = view.window()
+        self.subject = subject
+        self.token = token
+        self.resume = resume
+        self.project_folders = [os.path.abspath(f) for f in self.window.folders()]
+        self.found = []
+        self.usages = []
+        self.files_done = 0
+        self.files_total = 0
+        # Usages and files of the searches before the one resumed
+        self.previous = []
+        self.files_before = 0
+        self.done = False
+        self.trailing = None # The entry after the usages: "show more", "load more" or none
+        self.panel_id = 0
+        self.selected = 0
+        self.previewed = None
+        self.last_refresh = 0
+        self.refresh_scheduled = False
+        # Set once the user typed into or moved through the panel shown
+        self.interacted = False
+        self.initial_highlight = False
+
+    def on_progress(self, usages, files_done, files_total):
+        """Called from the search thread"""
+        self.found = self.previous + usages
+        self.files_done = self.files_before + files_done
+        self.files_total = self.files_before + files_total
+        if self.refresh_scheduled: return
+        self.refresh_scheduled = True
+        delay = self.panel_id and max(0, PANEL_REFRESH_INTERVAL - (time.time() - self.last_refresh) * 1000) or 0
+        sublime.set_timeout(self.refresh, int(delay))
+
+    def on_complete(self, usages):
+        """Called from the search thread"""
+        if usages is None: return # Cancelled
+        self.found = self.previous + usages
+        self.done = True
+        sublime.set_timeout(self.refresh, 0)
+
+    def refresh(self):
+        self.refresh_scheduled = False
+        if self.token.is_cancelled():
+            self.view.erase_status('GotoUsageSearch')
+            return
+
+        found = list(self.found)
+        if self.interacted:
+            self.set_more_status(len(found) - len(self.usages))
+            return
+
+        if self.done:
+            self.view.erase_status('GotoUsageSearch')
+        else:
+            self.view.set_status('GotoUsageSearch', 'GotoUsage: searching %d/%d files' % (self.files_done, self.files_total))
+
+        if len(found) == len(self.usages) and self.get_trailing(found) == self.trailing:
+            if self.done and not found:
+                sublime.status_message("GotoUsage: Could not find class/function/var '%s'" % self.subject)
+            return
+
+        self.set_usages(found)
+        self.show()
+
+    def get_trailing(self, found):
+        if not self.done:
+            return SHOW_MORE if found else None
+        if self.files_done < self.files_total:
+            return 'Load more usages (searched %d of %d files)' % (self.files_done, self.files_total)
+        return None
+
+    def set_usages(self, found):
+        # Shorten the paths by removing the project path from them
+        for usage in found[len(self.usages):]:
+            path = usage['path']
+            for project_folder in self.project_folders:
+                path = path.replace(project_folder, '')
+            usage['display_path'] = "%s:%d" % (path.strip('/\\'), usage['line_nr'])
+
+        self.usages = found
+        self.trailing = self.get_trailing(found)
+        self.last_refresh = time.time()
+
+    def set_more_status(self, num_more):
+        if self.done and not num_more:
+            self.view.erase_status('GotoUsageSearch')
+            return
+        self.view.set_status('GotoUsageSearch', 'GotoUsage: %d more usage%s%s, select "%s" to list them' % (
+            num_more, '' if num_more == 1 else 's', '' if self.done else ' (still searching)', SHOW_MORE))
+
+    def show(self):
+        self.panel_id += 1
+        panel_id = self.panel_id
+        self.initial_highlight = True
+        UsagePanel.active = self
+        menu_list = [i['display_path'] for i in self.usages]
+        if self.trailing:
+            menu_list.append(self.trailing)
+        self.window.show_quick_panel(menu_list,
+            lambda index: self.on_item_selected(panel_id, index), 0, self.selected,
+            lambda index: self.on_item_highlighted(panel_id, index))
+
+    def on_item_selected(self, panel_id, index):
+        if panel_id != self.panel_id: return # Replaced by a refreshed panel
+        UsagePanel.active = None
+        if index == len(self.usages) and self.trailing == SHOW_MORE:
+            self.show_more()
+            return
+        self.token.cancel()
+        self.view.erase_status('GotoUsageSearch')
+        if index == -1: return
+        if index == len(self.usages):
+            self.load_more()
+            return
+        core.open_usage(self.view, self.usages[index])
+
+    def on_item_highlighted(self, panel_id, index):
+        if panel_id != self.panel_id or index == -1: return
+        # Sublime highlights the selected item when the panel opens, anything else is the user
+        if self.initial_highlight and index == self.selected:
+            self.initial_highlight = False
+        else:
+            self.on_interaction()
+        if index == len(self.usages): return
+        self.selected = index
+        # Re-opened panels highlight the previewed usage again
+        if self.usages[index] is self.previewed: return
+        self.previewed = self.usages[index]
+        core.open_usage(self.view, self.usages[index], True)
+
+    def on_interaction(self):
+        """Stop re-opening the panel, which would reset what the user typed"""
+        if self.interacted: return
+        self.interacted = True
+        self.set_more_status(len(self.found) - len(self.usages))
+
+    def show_more(self):
+        """Re-open the panel with all usages found so far, refreshing it again until the user interacts"""
+        self.interacted = False
+        self.set_usages(list(self.found))
+        if self.done: self.view.erase_status('GotoUsageSearch')
+        self.show()
+
+    def load_more(self):
+        """Resume the search with the files it didn't get to"""
+        self.previous = list(self.usages)
+        self.files_before = self.files_done
+        self.done = False
+        self.interacted = False
+        self.token = core.SearchToken()
+        self.view.set_status('GotoUsageSearch', 'GotoUsage: searching %d/%d files' % (self.files_done, self.files_total))
+        self.resume(self.files_done, self.token)
+
+SHOW_MORE = 'Show more usages'
+
+class UsagePanelFilterListener(sublime_plugin.EventListener):
+    """Notices typing into the filter of a usage panel, which is a widget view"""
+    def on_modified(self, view):
+        if UsagePanel.active and view.settings().get('is_widget'):
+            UsagePanel.active.on_interaction()
+
+class GotoUsageCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit, subject = None):
 
         # Find wrapping class definition
         # If no class found, find wrapping function definition
 
-        subject = core.find_subject_name(self.view)
+        if not subject:
+            with stats.span('find_subject'):
+                subject = core.find_subject_name(self.view)
 
         if not subject:
             sublime.status_message("GotoUsage: Could not find class/function name to search for")
             return
 
-        def on_complete(found_usage_list):
-            if not len(found_usage_list):
-                sublime.status_message("GotoUsage: Could not find class/function/var '%s'" % subject)
-                return
+        self.search(subject)
+
+    def search(self, subject):
+        window = self.view.window()
+        project_folders = window.folders()
+        project_name = utils.get_project_name(window)
+        settings = utils.get_settings(project_name)
 
-            def on_item_selected(index):
-                core.open_usage(self.view, found_usage_list[index])
+        if not settings.get('disable_dep_graph', False):
+            found = get_dependant_files(self.view, lambda: self.search(subject), subject)
+            if not found: return
+            (files, index, names) = found
 
-            def on_item_highlighted(index):
-                core.open_usage(self.view, found_usage_list[index], True)
+        # Starting a new search cancels any previous one still in progress
+        token = core.SearchToken()
 
-            # Shorten the paths by removing the project path from them
-            for project_folder in project_folders:
-                path = os.path.abspath(project_folder)
-                for usage in found_usage_list:
-                    usage['display_path'] = "%s:%d" % (usage['path'].replace(path, '').strip('/\\'), usage['line_nr'])
+        if settings.get('disable_dep_graph', False):
+            panel = UsagePanel(self.view, subject, token)
+            operation = stats.operation('lookup', subject)
+            buffers = core.snapshot_buffers(window)
 
-            menu_list = [i['display_path'] for i in found_usage_list]
-            window.show_quick_panel(menu_list, on_item_selected, 0, 0, on_item_highlighted)
+            def on_complete(found_usage_list):
+                operation.finish(usages=len(found_usage_list or []), cancelled=found_usage_list is None)
+                panel.on_complete(found_usage_list)
 
-        if utils.get_setting('disable_dep_graph', False):
             RetValThread(
                 target=core.get_usages_in_folders,
-                args=[subject, project_folders],
+                args=[subject, project_folders, settings, token, panel.on_progress, buffers],
                 on_complete=on_complete
             ).start()
-        else:
-            g = core.graphs.get(utils.get_project_name(window), {})
-            if not g:
-                core.load_graph(utils.get_project_name(window))
-                # See if got it from cache
-                g = core.graphs.get(utils.get_project_name(window), {})
-                if not g: return
+            return
 
-            current_file = self.view.file_name()
-            files = g['graph'].get_dependants(current_file)
+        def search_files(files_done, token):
+            # Nearest files first, stopping early with a limit. "Load more" resumes from `files_done`
+            limit = core.SearchLimit(settings.get('max_usages', 0), settings.get('max_search_ms', 0))
+            operation = stats.operation('lookup', subject)
+            # Open files are searched as they are in the editor, unsaved changes included
+            buffers = core.snapshot_buffers(window)
 
-            # Append current file and make sure it's the last one
-            if current_file in files:
-                del files[files.index(current_file)]
-            files.append(current_file)
+            def on_complete(found_usage_list):
+                operation.finish(usages=len(found_usage_list or []), cancelled=found_usage_list is None,
+                    files=len(files) - files_done)
+                panel.on_complete(found_usage_list)
+                if index is not None and index.dirty:
+                    utils.save_index_changes(index, project_name)
 
             RetValThread(
                 target=core.get_usages_in_files,
-                args=[subject, files],
+                args=[subject, files[files_done:], index, token, panel.on_progress, project_name, limit, names, buffers],
                 on_complete=on_complete
             ).start()
 
+        panel = UsagePanel(self.view, subject, token, search_files)
+        search_files(0, token)
+
+GRAPH_STATE_MESSAGES = {
+    core.NOT_LOADED: 'loading',
+    core.LOADING: 'loading',
+    core.BUILDING: 'building'
+}
+
+def get_dependant_files(view, retry, subject = None):
+    """
+    Return (files, index, names): the file of `view` followed by the files depending on it, nearest first,
+    the usage index of the project and the names `subject` goes by in each file (see `core.find_visible_names`).
+    With `follow_imported_names`, files that don't import the subject are left out.
+    If the project's graph isn't ready yet, its loading is started (unless in progress) and None
+    is returned. `retry()` is called once the graph is ready unless another search started meanwhile.
+    """
+    project_name = utils.get_project_name(view.window())
+    g = core.graphs.get(project_name)
+    if not g:
+        token = core.SearchToken() # Cancels a previous search or wait
+
+        def on_ready(g):
+            if token.is_cancelled(): return
+            view.erase_status('GotoUsageSearch')
+            if g is None:
+                sublime.status_message("GotoUsage: Could not load the dependency graph of %s" % project_name)
+                return
+            retry()
+
+        state = core.request_graph(project_name, on_ready)
+        view.set_status('GotoUsageSearch', 'GotoUsage: %s the dependency graph, searching once it is ready' % (
+            GRAPH_STATE_MESSAGES.get(state, 'loading')))
+        return None
+
+    current_file = view.file_name()
+    with stats.span('graph_lookup'):
+        files = g['graph'].get_dependants(current_file)
+
+    # The current file is the nearest one
+    if current_file in files:
+        del files[files.index(current_file)]
+    files.insert(0, current_file)
+
+    names = None
+    settings = utils.get_settings(project_name)
+    if subject and core.is_identifier(subject) and settings.get('follow_imported_names', True):
+        with stats.span('follow_imports'):
+            names = core.find_visible_names(g, current_file, subject, settings)
+        files = [file_path for file_path in files if file_path in names]
+    return (files, g.get('index'), names)
+
+class GotoUsageAllCommand(sublime_plugin.TextCommand):
+    """
+    Find the usages of every class, function and var defined in the current file at once.
+    Lists the definitions with their number of usages; selecting one lists its usages.
+    """
+    def run(self, edit):
+        subjects = core.find_subject_names(self.view)
+        if not subjects:
+            sublime.status_message("GotoUsage: Could not find any class/function/var definitions to search for")
+            return
+        self.search(subjects)
+
+    def search(self, subjects):
+        window = self.view.window()
+        project_name = utils.get_project_name(window)
+        settings = utils.get_settings(project_name)
+        index = None
+
+        if settings.get('disable_dep_graph', False):
+            project_folders = window.folders()
+            target = lambda: core.get_usages_of_subjects(subjects,
+                core.list_files_in_folders(project_folders, settings), token=token, graph_based=False, settings=settings,
+                buffers=buffers)
+        else:
+            found = get_dependant_files(self.view, lambda: self.search(subjects))
+            if not found: return
+            (files, index, names) = found
+            target = lambda: core.get_usages_of_subjects(subjects, files, index, token, settings=settings, buffers=buffers)
+
+        token = core.SearchToken()
+        operation = stats.operation('batch_lookup', '%d subjects' % len(subjects))
+
+        def on_complete(usages):
+            operation.finish(subjects=len(subjects), cancelled=usages is None)
+            if index is not None and index.dirty:
+                utils.save_index_changes(index, project_name)
+            if usages is not None:
+                sublime.set_timeout(lambda: self.show(subjects, usages), 0)
+
+        sublime.status_message("GotoUsage: Searching the usages of %d definitions" % len(subjects))
+        buffers = core.snapshot_buffers(window)
+        RetValThread(target=target, on_complete=on_complete).start()
+
+    def show(self, subjects, usages):
+        items = [[subject, '%d usage%s' % (len(usages[subject]), '' if len(usages[subject]) == 1 else 's')]
+            for subject in subjects]
+
+        def on_select(index):
+            if index == -1: return
+            subject = subjects[index]
+            UsagePanel(self.view, subject, core.SearchToken()).on_complete(usages[subject])
+
+        self.view.window().show_quick_panel(items, on_select)
+
 building_graphs = []
 
 class GotoUsageClearCachesCommand(sublime_plugin.WindowCommand):
@@ -91,28 +394,32 @@ class GotoUsageClearCachesCommand(sublime_plugin.WindowCommand):
         if building_graphs:
             sublime.status_message("GotoUsage: Please wait while the current dependency graph has finished building")
             return
-        utils.clear_caches()
-        core.graphs = {}
+        watcher.unwatch_all()
+        utils.clear_caches(utils.get_settings(utils.get_project_name(self.window)))
+        core.clear_graphs()
         sublime.status_message("GotoUsage: Cleared all dependency graphs")
 
 class GotoUsageBuildGraphCommand(sublime_plugin.WindowCommand):
     def run(self, project_name = None):
         global building_graphs
 
+        project_name = project_name or utils.get_active_project_name()
         if project_name in building_graphs: return
 
         g = {
             'last_update': None,
-            'graph': DepGraph()
+            'graph': DepGraph(),
+            'index': core.create_index(project_name)
         }
 
         project_folders = self.window.folders()
-        project_name = project_name or utils.get_active_project_name()
+        settings = utils.get_settings(project_name)
         self.window.active_view().erase_status('GotoUsage')
 
         building_graphs.append(project_name)
+        core.set_graph_state(project_name, core.BUILDING)
         self.loading_frame = 0
-        self.loading_start = time.time()
+        operation = stats.operation('build', project_name)
 
         def erase_status():
             self.window.active_view().erase_status('GotoUsage')
@@ -120,29 +427,97 @@ class GotoUsageBuildGraphCommand(sublime_plugin.WindowCommand):
         def show_progress():
             global building_graphs
             if project_name not in building_graphs or project_name != building_graphs[0]: return
-            self.window.active_view().set_status('GotoUsage', '[%s] GotoUsage: %d dependencies' % (core.LOADING_FRAMES[self.loading_frame], g['graph'].num_deps))
+            progress = g.get('progress', {'files_found': 0, 'files_done': 0})
+            self.window.active_view().set_status('GotoUsage', '[%s] GotoUsage: %d/%d files, %d dependencies' % (
+                core.LOADING_FRAMES[self.loading_frame], progress['files_done'], progress['files_found'], g['graph'].num_deps))
             self.loading_frame = (self.loading_frame + 1) % len(core.LOADING_FRAMES)
-            if time.time() - self.loading_start > 60: # Taking too much time, bail
-                erase_status()
-                del building_graphs[building_graphs.index(project_name)]
-            else:
-                sublime.set_timeout(show_progress, 100)
+            sublime.set_timeout(show_progress, 100)
 
         def on_complete():
             global building_graphs
             if project_name in building_graphs:
                 del building_graphs[building_graphs.index(project_name)]
-            core.graphs[project_name] = g
+            operation.finish(files=len(g['manifest']), dependencies=g['graph'].num_deps)
+            core.register_graph(project_name, g)
             utils.save_graph(g, project_name)
-            utils.log('Built graph with %d dependencies' %  g['graph'].num_deps)
+            if g['index'] is not None:
+                utils.save_index(g['index'], project_name)
+            utils.log('Built graph with %d dependencies' %  g['graph'].num_deps, settings=settings)
             self.window.active_view().set_status('GotoUsage', 'GotoUsage complete: found %d dependencies' % g['graph'].num_deps)
             sublime.set_timeout(erase_status, 4000)
 
+        def build():
+            try:
+                core.build_graph(g, project_folders, settings=settings, on_complete=on_complete)
+            except Exception:
+                if project_name in building_graphs:
+                    del building_graphs[building_graphs.index(project_name)]
+                # Let searches waiting for the graph know it failed
+                core.set_graph_state(project_name, core.NOT_LOADED)
+                erase_status()
+                raise
+
         show_progress()
 
-        threading.Thread(target=core.build_graph, args=[g, project_folders], kwargs={
-            "on_complete": on_complete
-        }).start()
+        threading.Thread(target=build).start()
+
+class GotoUsageShowStatsCommand(sublime_plugin.WindowCommand):
+    """Show the collected performance stats in a new view, or as JSON with `dump`"""
+    def run(self, dump = False):
+        if dump:
+            path = os.path.join(utils.get_cache_dir(), 'stats.json')
+            stats.dump(path)
+            self.window.open_file(path)
+            return
+        view = self.window.new_file()
+        view.set_name('GotoUsage Stats')
+        view.set_scratch(True)
+        view.run_command('append', {'characters': stats.format_report()})
+        view.set_read_only(True)
+
+class GotoUsagePickDefinitionCommand(sublime_plugin.TextCommand):
+    """Pick one of the class/function/var definitions in the file to find the usages of"""
+    def run(self, edit):
+        definitions = outline.get_outline(self.view).get_definitions()
+        if not definitions:
+            sublime.status_message("GotoUsage: Could not find any class/function/var definitions in this file")
+            return
+
+        viewport_position = self.view.viewport_position()
+        (current_region, current_line) = utils.get_current_line(self.view)
+        selected = 0
+        for (i, (start, end, name, kind)) in enumerate(definitions):
+            if start <= current_region.b: selected = i
+
+        items = [[name, '%s, line %d' % (kind, self.view.rowcol(start)[0] + 1)]
+            for (start, end, name, kind) in definitions]
+
+        def on_highlight(index):
+            self.view.show_at_center(definitions[index][0])
+
+        def on_select(index):
+            if index == -1:
+                self.view.set_viewport_position(viewport_position, False)
+                return
+            self.view.run_command('goto_usage', {'subject': definitions[index][2]})
+
+        self.view.window().show_quick_panel(items, on_select, 0, selected, on_highlight)
+
+if hasattr(sublime_plugin, 'TextChangeListener'):
+    class OutlineListener(sublime_plugin.TextChangeListener):
+        """Records the edits made to a buffer for its outline, once it has one"""
+        @classmethod
+        def is_applicable(cls, buffer):
+            return True
+
+        def on_text_changed(self, changes):
+            view = self.buffer.primary_view()
+            if view is None: return
+            outline.on_text_changed(view, [(change.a.pt, change.b.pt, len(change.str)) for change in changes])
+
+class OutlineCloseListener(sublime_plugin.EventListener):
+    def on_close(self, view):
+        outline.forget(view.buffer_id())
 
 class FileOpenListener(sublime_plugin.EventListener):
     """
@@ -159,5 +534,8 @@ class FileOpenListener(sublime_plugin.EventListener):
 class FileSaveListener(sublime_plugin.EventListener):
     """Refresh the dependencies of a file upon saving."""
     def on_post_save_async(self, view):
-        if utils.file_filter(view.file_name()):
-            core.refresh_dependencies(view.file_name(), utils.get_project_name(view))
+        core.get_parse_cache().invalidate(view.file_name())
+        core.invalidate_results(view.file_name())
+        project_name = utils.get_project_name(view)
+        if utils.get_settings(project_name).file_filter(view.file_name()):
+            core.refresh_dependencies(view.file_name(), project_name)
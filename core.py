@@ -1,31 +1,46 @@
 import os
 import re
 import time
+import threading
 import sublime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from . import utils
+from . import lexer
+from . import outline
+from . import stats
+from . import watcher
 from .dep_graph import DepGraph
+from .graph_store import GraphStore
+from .usage_index import UsageIndex, check_stat, content_hash, file_stat
+from .lexer import IDENTIFIER_RE, IGNORED_PREFIX, IGNORED_BEFORE, IGNORED_SUFFIX
+from .lexer import SINGLE_LINE_IMPORT_RE, MULTI_LINE_IMPORT_START_RE, MULTI_LINE_IMPORT_END_RE
+from .outline import CLASS_REGEX, FUNCTION_REGEX, VAR_REGEX
 
-graphs = {}
-
-CLASS_REGEX = {
-    'regex': r'class ([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+)',
-    'group': [1]
-}
-FUNCTION_REGEX = {
-    'regex': r'(function\s+([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+).+{$)|(def\s([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+).+:$)',
-    'group': [2, 4]
-}
-VAR_REGEX = {
-    'regex': r'(var|let|const)\s+([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+)\s*=',
-    'group': [2]
-}
+def on_graph_evicted(project_name, g, size):
+    utils.log('Evicted graph for %s (~%.1f MB) to stay within the memory budget' % (project_name, size / 1024 / 1024), project_name=project_name)
+    stats.count('graphs_evicted')
+    watcher.unwatch(project_name)
+    set_graph_state(project_name, NOT_LOADED)
+    # The graph itself is saved on every change, lookups may have indexed files since the index was
+    if g.get('index') is not None and g['index'].dirty:
+        utils.save_index_changes(g['index'], project_name)
+
+graphs = GraphStore(on_evict=on_graph_evicted)
+
+# Loading state of a project's graph, see `request_graph`
+NOT_LOADED = 'not_loaded'
+LOADING = 'loading'
+READY = 'ready'
+BUILDING = 'building'
+
+graph_states = {}
+graph_waiters = {}
+graph_lock = threading.Lock()
 
 SINGLE_LINE_COMMENT = ['#', '//']
 MULTI_LINE_COMMENT_START = ['/*']
 MULTI_LINE_COMMENT_END = ['*/']
-SINGLE_LINE_IMPORT_RE = r'\b(import|require|include)[^\[:.].*[\'\"][^\'\"]+[\'\"].*$'
-MULTI_LINE_IMPORT_START_RE = r'\b(import|require|include)\b[\s()\[\]{}]*$'
-MULTI_LINE_IMPORT_END_RE = r'^[)}\]](\s*from.+)?$'
 
 C_ANY                 = 0b111111111
 C_CODE                = 0b000000001
@@ -40,26 +55,6 @@ C_MULTI_COMMENT_START = 0b001000000
 C_MULTI_COMMENT       = 0b010000000
 C_MULTI_COMMENT_END   = 0b100000000
 
-IGNORED_PREFIX = [
-    'import',
-    'include',
-    'require',
-    'function',
-    'const',
-    'var',
-    'let',
-    'def',
-    'class'
-]
-IGNORED_BEFORE = [
-    'import',
-    'include',
-    'require'
-]
-IGNORED_SUFFIX = [
-    ':',
-    '='
-]
 LOADING_FRAMES = [
     '=    ',
     ' =   ',
@@ -85,23 +80,15 @@ def find_subject_name_on_current_line(view, regex):
     (current_region, current_line) = utils.get_current_line(view)
     return get_item_name_on_line(current_line, regex)
 
-def find_subject_name_upwards(view, regex):
+def find_subject_name_upwards(view, kind):
     """
-    Find a matching regex-based definition either on the current line or
-    the first one going upwards from the current cursor position.
+    Find the first definition of a kind (an index into `outline.KINDS`) going upwards
+    from the current line, or the first one in the view if there are none above.
     """
     (current_region, current_line) = utils.get_current_line(view)
-
-    regions = view.find_all(regex['regex'])
-    if not regions: return None
-
-    # Find the first match going backwards from current position
-    for region in reversed(regions):
-      if region.b < current_region.a:
-        return get_item_name_on_line(view.substr(region), regex)
-
-    # Cursor is before any class definitions... return the first one
-    return get_item_name_on_line(view.substr(regions[0]), regex)
+    with stats.span('outline'):
+        view_outline = outline.get_outline(view)
+    return view_outline.find_upwards(kind, current_region.a)
 
 def find_subject_name(view):
     """
@@ -111,9 +98,24 @@ def find_subject_name(view):
     return (find_subject_name_on_current_line(view, CLASS_REGEX)
         or find_subject_name_on_current_line(view, FUNCTION_REGEX)
         or find_subject_name_on_current_line(view, VAR_REGEX)
-        or find_subject_name_upwards(view, CLASS_REGEX)
-        or find_subject_name_upwards(view, FUNCTION_REGEX)
-        or find_subject_name_upwards(view, VAR_REGEX))
+        or find_subject_name_upwards(view, outline.CLASS)
+        or find_subject_name_upwards(view, outline.FUNCTION)
+        or find_subject_name_upwards(view, outline.VAR))
+
+def find_subject_names(view):
+    """
+    Find the names of all classes, functions and vars defined in a view,
+    in order of appearance.
+    """
+    with stats.span('outline'):
+        definitions = outline.get_outline(view).get_definitions()
+    names = []
+    seen = set()
+    for (start, end, name, kind) in definitions:
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
 
 def is_actual_usage(line, subject):
     line_split = line.split(subject, 1)
@@ -151,10 +153,10 @@ def is_actual_usage(line, subject):
 
     return True
 
-def parse_lines(f, yield_context=C_ANY):
+def classify_lines(f):
     """
-    Generator for looping over lines in a file while ignoring comments.
-    Works like a state-machine emitting only the necessary states (contexts).
+    Generator for looping over lines in a file, classifying each line by context.
+    Works like a state-machine yielding (line_start, line_nr, context, line) for every line.
     Continues to next line as early as possible for speeeed.
     """
     current_context = [C_CODE] # Default context when nothing else mathces
@@ -170,7 +172,7 @@ def parse_lines(f, yield_context=C_ANY):
             is_single_multi = True in (c in line for c in MULTI_LINE_COMMENT_START) and \
                 True in (c in line for c in MULTI_LINE_COMMENT_END)
             if is_single_line_comment or is_single_multi:
-                if yield_context & C_COMMENT: yield (line_start, line_nr, line_unstripped)
+                yield (line_start, line_nr, C_SINGLE_COMMENT, line_unstripped)
                 line_start += len(line_unstripped)
                 continue
 
@@ -178,7 +180,7 @@ def parse_lines(f, yield_context=C_ANY):
         if current_context[-1] & C_MULTI_COMMENT:
             is_comment_end = True in (c in line for c in MULTI_LINE_COMMENT_END)
             if is_comment_end:
-                if yield_context & C_MULTI_COMMENT_END: yield (line_start, line_nr, line_unstripped)
+                yield (line_start, line_nr, C_MULTI_COMMENT_END, line_unstripped)
                 line_start += len(line_unstripped)
                 current_context.pop()
                 continue # Kinda assuming nothing comes after `*/` here
@@ -188,7 +190,7 @@ def parse_lines(f, yield_context=C_ANY):
             is_comment_start = True in (c in line for c in MULTI_LINE_COMMENT_START)
             if is_comment_start:
                 current_context.append(C_MULTI_COMMENT)
-                if yield_context & C_MULTI_COMMENT_START: yield (line_start, line_nr, line_unstripped)
+                yield (line_start, line_nr, C_MULTI_COMMENT_START, line_unstripped)
                 line_start += len(line_unstripped)
                 continue
 
@@ -197,7 +199,7 @@ def parse_lines(f, yield_context=C_ANY):
             not current_context[-1] & C_MULTI_COMMENT:
             is_single_line_import = re.search(SINGLE_LINE_IMPORT_RE, line)
             if is_single_line_import:
-                if yield_context & C_SINGLE_IMPORT: yield (line_start, line_nr, line_unstripped)
+                yield (line_start, line_nr, C_SINGLE_IMPORT, line_unstripped)
                 line_start += len(line_unstripped)
                 continue
 
@@ -206,7 +208,7 @@ def parse_lines(f, yield_context=C_ANY):
             not current_context[-1] & C_MULTI_COMMENT:
             is_import_end = re.search(MULTI_LINE_IMPORT_END_RE, line)
             if is_import_end:
-                if yield_context & C_MULTI_IMPORT_END: yield (line_start, line_nr, line_unstripped)
+                yield (line_start, line_nr, C_MULTI_IMPORT_END, line_unstripped)
                 current_context.pop()
                 line_start += len(line_unstripped)
                 continue
@@ -217,162 +219,879 @@ def parse_lines(f, yield_context=C_ANY):
             is_import_start = re.search(MULTI_LINE_IMPORT_START_RE, line)
             if is_import_start:
                 current_context.append(C_MULTI_IMPORT)
-                if yield_context & C_MULTI_IMPORT_START: yield (line_start, line_nr, line_unstripped)
+                yield (line_start, line_nr, C_MULTI_IMPORT_START, line_unstripped)
                 line_start += len(line_unstripped)
                 continue
 
         # No context switch detected: yield current context for current line
 
-        if yield_context & current_context[-1]:
-            yield (line_start, line_nr, line_unstripped)
+        yield (line_start, line_nr, current_context[-1], line_unstripped)
 
         line_start += len(line_unstripped)
 
-def find_imports_in_file(f):
+def parse_lines(f, yield_context=C_ANY):
+    """
+    Generator for looping over lines in a file while ignoring comments.
+    Emits (line_start, line_nr, line) only for the lines in the necessary contexts.
+    """
+    for (line_start, line_nr, context, line) in classify_lines(f):
+        if yield_context & context:
+            yield (line_start, line_nr, line)
+
+parse_cache = None
+
+def get_parse_cache_budget():
+    return utils.get_setting('parse_cache_size_mb', 64) * 1024 * 1024
+
+def get_parse_cache():
+    global parse_cache
+    if parse_cache is None:
+        parse_cache = utils.LRUCache(get_parse_cache_budget(), sizeof=lambda entry: entry['size'])
+    return parse_cache
+
+def read_bytes(file_path):
+    with stats.span('read_file'):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    stats.count('files_read')
+    stats.count('bytes_read', len(data))
+    return data
+
+def decode(data, file_path, settings = None):
+    """
+    Decode the raw contents of a file like reading it in text mode does: UTF-8 with universal newlines.
+    Returns None for binary files (containing NUL bytes) and files that aren't valid UTF-8.
+    Skipped files are logged with the `settings` of the operation at hand.
+    """
+    if b'\0' in data:
+        text = None
+    else:
+        try:
+            text = data.decode('utf8')
+        except UnicodeDecodeError:
+            text = None
+    if text is None:
+        utils.log("Skipping binary or non UTF-8 file", file_path, settings=settings)
+        stats.count('files_skipped')
+        return None
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def read_file(file_path, settings = None):
+    "Return the text of a file, empty if it's binary or not UTF-8"
+    return decode(read_bytes(file_path), file_path, settings) or ''
+
+def get_cached_parse(file_path, stat):
+    "Return the parse cache entry of a file if it's unchanged since it was parsed"
+    entry = get_parse_cache().get(file_path)
+    if entry and entry['stat'] == stat:
+        stats.count('parse_cache_hits')
+        return entry
+    stats.count('parse_cache_misses')
+    return None
+
+def parse_file(file_path, data, stat, settings = None):
+    "Scan the raw contents of a file and add it to the parse cache"
+    entry = parse_text(file_path, decode(data, file_path, settings) or '', stat)
+    entry['hash'] = content_hash(data)
+    return entry
+
+def parse_text(file_path, text, stat):
+    with stats.span('tokenize'):
+        entry = lexer.scan(text)
+    stats.count('lines_tokenized', text.count('\n') + 1)
+    entry['stat'] = stat
+    entry['size'] = len(text) * 4 + len(entry['segments']) * 150
+    get_parse_cache().set(file_path, entry)
+    return entry
+
+def get_parsed_file(file_path, buffer = None, settings = None):
+    """
+    Return the `lexer.scan` of a file: its code segments, joined code and imported paths.
+    Served from the parse cache as long as the file's mtime and size are unchanged.
+    Binary and non UTF-8 files are scanned as empty. Files open in the editor without
+    unsaved changes are parsed from their `buffer` (see `snapshot_buffers`) instead of disk.
+    """
+    stat = file_stat(file_path)
+    entry = get_cached_parse(file_path, stat)
+    if entry: return entry
+    if buffer and not buffer['dirty']:
+        stats.count('buffers_read')
+        return parse_text(file_path, buffer['text'], stat)
+    return parse_file(file_path, read_bytes(file_path), stat, settings)
+
+def get_fingerprint(file_path, buffer = None, settings = None):
+    """
+    Return the [mtime, size, hash] entry recorded for a file in the manifest and the usage index,
+    see `check_stat`. Served from the parse cache like `get_parsed_file`. Files parsed from a
+    `buffer` get no hash: the buffer's text has its newlines normalized, unlike the raw bytes
+    hashed on disk.
+    """
+    entry = get_parsed_file(file_path, buffer, settings)
+    data_hash = entry.get('hash')
+    if data_hash is None:
+        if buffer: return list(entry['stat'])
+        data_hash = content_hash(read_bytes(file_path))
+    return entry['stat'] + [data_hash]
+
+def get_parsed_file_containing(file_path, subjects, buffers = None, settings = None):
+    """
+    Like `get_parsed_file` but returns None without decoding or parsing the file when its raw
+    bytes contain none of `subjects`, which is the case for most files searched.
+    Files open in the editor are read from their buffer in `buffers`, see `snapshot_buffers`.
+    """
+    stat = get_stat(file_path, buffers)
+    entry = get_cached_parse(file_path, stat)
+    if entry: return entry
+    buffer = get_buffer(file_path, buffers)
+    if buffer:
+        stats.count('buffers_read')
+        for subject in subjects:
+            if subject in buffer['text']:
+                return parse_text(file_path, buffer['text'], stat)
+        stats.count('files_prefiltered')
+        return None
+    data = read_bytes(file_path)
+    for subject in subjects:
+        if subject.encode('utf8') in data:
+            return parse_file(file_path, data, stat, settings)
+    stats.count('files_prefiltered')
+    return None
+
+# The last snapshot of `snapshot_buffers`, to copy only the buffers that changed since
+last_buffers = {}
+
+def snapshot_buffers(window):
+    """
+    Snapshot the files open in `window` so that the searches they're passed to read them from
+    the editor instead of from disk, unsaved changes included. Must be called on the UI thread.
+    Returns {path: {'key', 'dirty', 'text'}} where `key` identifies the buffer and its change count.
+    Buffers unchanged since the previous snapshot aren't copied again.
+    """
+    global last_buffers
+    snapshot = {}
+    for view in window.views():
+        file_path = view.file_name()
+        if not file_path or view.is_loading(): continue
+        key = (view.buffer_id(), view.change_count())
+        entry = last_buffers.get(file_path)
+        text = entry['text'] if entry and entry['key'] == key else view.substr(sublime.Region(0, view.size()))
+        snapshot[file_path] = {'key': key, 'dirty': view.is_dirty(), 'text': text}
+    last_buffers = snapshot
+    return snapshot
+
+def get_buffer(file_path, buffers):
+    return buffers.get(file_path) if buffers else None
+
+def is_dirty_buffer(file_path, buffers):
+    "Return True if `file_path` has unsaved changes in the editor as of the `buffers` snapshot"
+    buffer = get_buffer(file_path, buffers)
+    return bool(buffer) and buffer['dirty']
+
+def get_stat(file_path, buffers = None):
     """
-    Uses some broad keywords and quotation-searching to find imports.
-    Only supports imports that are between quotes and that are actual path strings.
+    Like `file_stat` but files with unsaved changes are identified by their buffer and change count
+    instead, so the caches keyed by it never mix up the contents on disk and in the editor.
     """
-    deps = []
-    for (line_start, line_nr, line) in parse_lines(f, C_SINGLE_IMPORT | C_MULTI_IMPORT | C_MULTI_IMPORT_END):
-        paths = re.findall(r'[\'\"]([^\'\"]+)[\'\"]', line)
-        if paths: deps.append(paths[-1])
-    return deps
+    buffer = get_buffer(file_path, buffers)
+    if buffer and buffer['dirty']:
+        return ['buffer', buffer['key'][0], buffer['key'][1]]
+    return file_stat(file_path)
+
+def is_identifier(subject):
+    match = IDENTIFIER_RE.match(subject)
+    return bool(match) and match.end() == len(subject)
+
+def make_usage(file_path, subject, line_nr, offset):
+    return {
+        'line_nr': line_nr,
+        'path': file_path,
+        'region': sublime.Region(offset, offset + len(subject))
+    }
+
+def get_usages_in_file(file_path, subject, buffers = None, settings = None):
+    if not is_identifier(subject):
+        return get_usages_in_lines(file_path, subject, buffers, settings)
+    parsed = get_parsed_file_containing(file_path, [subject], buffers, settings)
+    if not parsed: return []
+    with stats.span('find_usages'):
+        usages = lexer.find_usages(parsed, subject)
+    return [make_usage(file_path, subject, line_nr, offset) for (line_nr, offset) in usages]
 
-def get_usages_in_file(file_path, subject):
+def get_usages_in_lines(file_path, subject, buffers = None, settings = None):
+    """
+    Line based search for subjects that aren't plain identifiers (and thus aren't tokenized).
+    Only the first occurrence on each line is considered.
+    """
     usage_regions = []
-    with open(file_path, 'r', encoding='utf8') as f:
-        for (line_start, line_nr, line) in parse_lines(f, C_CODE):
-            if subject not in line: continue
-            if not is_actual_usage(line, subject): continue
-            offset = line.find(subject)
-            usage_regions.append({
-                'line_nr': line_nr,
-                'path': file_path,
-                'region': sublime.Region(line_start + offset, line_start + offset + len(subject))
-            })
+    check_usage = stats.timed('is_actual_usage', is_actual_usage) if stats.enabled else is_actual_usage
+    buffer = get_buffer(file_path, buffers)
+    if buffer:
+        stats.count('buffers_read')
+        text = buffer['text']
+        found = subject in text
+    else:
+        data = read_bytes(file_path)
+        found = subject.encode('utf8') in data
+    if not found:
+        stats.count('files_prefiltered')
+        return []
+    if not buffer:
+        text = decode(data, file_path, settings) or ''
+    for (line_start, line_nr, line) in parse_lines(text.splitlines(True), C_CODE):
+        if subject not in line: continue
+        if not check_usage(line, subject): continue
+        offset = line.find(subject)
+        usage_regions.append(make_usage(file_path, subject, line_nr, line_start + offset))
 
     return usage_regions
 
-def get_usages_in_files(subject, files):
+def get_postings_in_file(file_path, buffer = None, settings = None):
     """
-    Smart approach: reads files from a list and parses them.
+    Find the usages of every identifier in a file at once.
+    Returns {identifier: [[line_nr, offset], ...]} for the usage index.
     """
+    code_segments = get_parsed_file(file_path, buffer, settings)['segments']
+    with stats.span('find_usages'):
+        return lexer.find_all_usages(code_segments)
 
-    usage_list = []
-
-    for file_path in files:
+def ensure_indexed(file_path, index, buffer = None, settings = None):
+    """
+    Re-index `file_path` unless it's unchanged since it was indexed. Files open in the editor
+    without unsaved changes are indexed from their `buffer` and only checked again once it changes.
+    """
+    buffer_key = buffer['key'] if buffer and not buffer['dirty'] else None
+    if index.is_fresh(file_path, buffer_key):
+        stats.count('index_hits')
+    else:
+        stats.count('index_misses')
         try:
-            usages = get_usages_in_file(file_path, subject)
-            usage_list.extend(usages)
-        except UnicodeDecodeError:
-            utils.log("Failed to open file", file_path, warning=True)
+            index.set_file(file_path, get_postings_in_file(file_path, buffer, settings), get_fingerprint(file_path, buffer, settings),
+                buffer_key)
         except FileNotFoundError:
-            utils.log("File not found", file_path, warning=True)
+            index.remove_file(file_path)
+            raise
+
+def get_usages_in_indexed_file(file_path, subject, index, buffer = None, settings = None):
+    """
+    Read the usages from the index if the file is unchanged since it was indexed.
+    Stale or missing entries are rescanned, which also re-indexes the file.
+    """
+    ensure_indexed(file_path, index, buffer, settings)
+    return [make_usage(file_path, subject, line_nr, offset)
+        for (line_nr, offset) in index.get_postings(subject, file_path)]
+
+def get_usages_of_identifiers_in_file(file_path, subjects, subjects_re, index = None, buffers = None, settings = None):
+    """
+    Find the usages of several identifiers in a file, reading it at most once.
+    `subjects_re` is `lexer.compile_subjects(subjects)`. Returns (subject, usage) pairs.
+    """
+    if index is not None and not is_dirty_buffer(file_path, buffers):
+        ensure_indexed(file_path, index, get_buffer(file_path, buffers), settings)
+        return [(subject, make_usage(file_path, subject, line_nr, offset))
+            for subject in subjects for (line_nr, offset) in index.get_postings(subject, file_path)]
+    parsed = get_parsed_file_containing(file_path, subjects, buffers, settings)
+    if not parsed: return []
+    with stats.span('find_usages'):
+        found = lexer.find_usages_of(parsed, subjects_re)
+    return [(subject, make_usage(file_path, subject, line_nr, offset))
+        for (subject, usages) in found.items() for (line_nr, offset) in usages]
+
+def iter_files(fn, files, settings = None):
+    """
+    Call `fn` for each file on a pool of `scan_workers` threads (from the project `settings`,
+    the active project's by default).
+    Yields the results in the order of `files` regardless of completion order.
+    """
+    files = list(files)
+    num_workers = min((settings or utils.get_settings()).get('scan_workers', 4) or 1, len(files))
+    if num_workers <= 1:
+        for f in files: yield fn(f)
+        return
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for result in pool.map(fn, files):
+            yield result
+
+def map_files(fn, files, settings = None):
+    """Like `iter_files` but returns all results at once"""
+    return list(iter_files(fn, files, settings))
+
+search_generation = 0
+
+class SearchToken:
+    """
+    Identifies a single usage search.
+    A search is cancelled explicitly or as soon as a newer search is started.
+    """
+
+    def __init__(self):
+        global search_generation
+        search_generation += 1
+        self.generation = search_generation
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_cancelled(self):
+        return self.cancelled or self.generation != search_generation
+
+def scan_file(file_path, subject, index = None, graph_based = True, buffers = None, settings = None):
+    """
+    Find the usages in a single file, logging instead of raising on unreadable files.
+    Files with unsaved changes in `buffers` are searched in the editor's buffer rather than the `index`.
+    """
+    if index is not None and not is_dirty_buffer(file_path, buffers):
+        buffer = get_buffer(file_path, buffers)
+        return scan_safely(lambda path: get_usages_in_indexed_file(path, subject, index, buffer, settings), file_path, graph_based)
+    return scan_safely(lambda path: get_usages_in_file(path, subject, buffers, settings), file_path, graph_based)
+
+def scan_safely(scan, file_path, graph_based = True):
+    """Return `scan(file_path)`, logging instead of raising on unreadable files"""
+    stats.count('files_scanned')
+    try:
+        return scan(file_path)
+    except FileNotFoundError:
+        utils.log("File not found", file_path, warning=True)
+        if graph_based:
             utils.log("Probably the file has been (re)moved and the dependency graph is stale. Please rebuild!", warning=True)
             sublime.active_window().status_message("GotoUsage Error! Dependency graph looks out of date. Please rebuild!")
+    return []
 
+class SearchLimit:
+    """
+    Stops a search early once it found `max_usages` usages or ran for `max_ms` milliseconds
+    (0 for no limit). A search stopped early returns the usages found so far, the files
+    it didn't get to are those past the `files_done` last reported to `on_progress`.
+    """
+
+    def __init__(self, max_usages = 0, max_ms = 0):
+        self.max_usages = max_usages
+        self.max_ms = max_ms
+        self.start = time.time()
+
+    def is_reached(self, num_usages):
+        if self.max_usages and num_usages >= self.max_usages: return True
+        return bool(self.max_ms) and (time.time() - self.start) * 1000 >= self.max_ms
+
+def collect_usages(scan, files, token = None, on_progress = None, limit = None, select = None, settings = None):
+    """
+    Scan `files` with `scan` on the worker pool, collecting the usages in file order.
+    `on_progress(usages, files_done, files_total)` is called after each file with the usages so far.
+    Returns None if `token` got cancelled in the meantime. Stops once a `SearchLimit` is reached.
+    Files for which `select(file_path)` is False are known not to contain any usages and are
+    skipped without being scanned, progress still counts them.
+    """
+    files = list(files)
+    positions = [i for (i, file_path) in enumerate(files) if select(file_path)] if select else range(len(files))
+    selected = [files[i] for i in positions]
+    stopped = False
+
+    def scan_unless_cancelled(file_path):
+        if stopped or (token and token.is_cancelled()): return []
+        return scan(file_path)
+
+    usage_list = []
+    files_done = 0
+    results = iter_files(scan_unless_cancelled, selected, settings)
+    try:
+        for (position, usages) in zip(positions, results):
+            if token and token.is_cancelled(): return None
+            usage_list.extend(usages)
+            files_done = position + 1
+            if on_progress: on_progress(usage_list, files_done, len(files))
+            if limit and files_done < len(files) and limit.is_reached(len(usage_list)):
+                stats.count('searches_stopped_early')
+                stopped = True # Skip the files already queued on the pool
+                break
+    finally:
+        results.close()
+    if not stopped:
+        if select: stats.count('files_skipped_by_index', len(files) - len(selected))
+        if on_progress and files_done < len(files): on_progress(usage_list, len(files), len(files))
     return usage_list
 
-def get_usages_in_folders(subject, folders):
+result_cache = None
+
+def get_result_cache():
+    global result_cache
+    if result_cache is None:
+        result_cache = utils.LRUCache(utils.get_setting('result_cache_size', 50))
+    return result_cache
+
+def resize_caches():
+    "Apply changes of the cache size settings to the parse and result caches created so far"
+    if parse_cache is not None:
+        parse_cache.resize(get_parse_cache_budget())
+    if result_cache is not None:
+        result_cache.resize(utils.get_setting('result_cache_size', 50))
+
+def invalidate_results(file_path):
+    """Forget the cached usages found in `file_path` for all subjects"""
+    for results in get_result_cache().values():
+        results.pop(file_path, None)
+
+def scan_file_cached(file_path, results, scan, variant = None, buffers = None):
+    """
+    Return the usages in `file_path` from `results` ({path: (stat, usages, variant)}) if the file
+    is unchanged since they were found with the same `variant` of the search, otherwise scan it
+    and update `results`.
+    """
+    try:
+        stat = get_stat(file_path, buffers)
+    except OSError:
+        stat = None
+    cached = results.get(file_path)
+    if stat and cached and cached[0] == stat and cached[2] == variant:
+        stats.count('result_cache_hits')
+        return cached[1]
+    stats.count('result_cache_misses')
+    usages = scan(file_path)
+    if stat: results[file_path] = (stat, usages, variant)
+    return usages
+
+def get_usages_in_files(subject, files, index = None, token = None, on_progress = None, project_name = None, limit = None, names = None,
+        buffers = None):
+    """
+    Smart approach: reads files from a list and parses them.
+    Files that are up to date in the usage `index` are not read at all.
+    With a `project_name`, usages are cached per subject and only files that changed
+    since the last search for the same subject are scanned again.
+    Files are scanned in order, with a `SearchLimit` the search stops early once it's reached.
+    `names` ({path: names}, see `find_visible_names`) are the names the subject goes by in
+    each file, files not in it are searched for the subject itself. Open files are searched
+    in `buffers`, see `snapshot_buffers`.
+    """
+
+    if index is not None and not is_identifier(subject):
+        index = None # Only identifiers are indexed
+    settings = utils.get_settings(project_name)
+
+    def get_names(file_path):
+        return (names.get(file_path) if names else None) or (subject,)
+
+    select = None
+    if index is not None:
+        # Files indexed without any of their names can't contain usages
+        select = lambda file_path: index_may_contain(index, file_path, get_names(file_path), buffers)
+
+    def scan(file_path):
+        file_names = get_names(file_path)
+        if len(file_names) == 1:
+            return scan_file(file_path, file_names[0], index, buffers=buffers, settings=settings)
+        usages = [usage for name in file_names for usage in scan_file(file_path, name, index, buffers=buffers, settings=settings)]
+        return sorted(usages, key=lambda usage: usage['region'].a)
+
+    cache = get_result_cache()
+    if project_name is not None and cache.budget > 0:
+        key = (project_name, subject)
+        results = cache.get(key)
+        if results is None:
+            results = {}
+            cache.set(key, results)
+        uncached_scan = scan
+        scan = lambda file_path: scan_file_cached(file_path, results, uncached_scan, get_names(file_path), buffers)
+
+    return collect_usages(scan, files, token, on_progress, limit, select, settings)
+
+def index_may_contain(index, file_path, subjects, buffers = None):
+    """
+    Return False if `file_path` is indexed without any of `subjects`. The index is trusted
+    to be as fresh as the dependency graph, files with unsaved changes are always searched.
+    """
+    if not index.has_file(file_path) or is_dirty_buffer(file_path, buffers): return True
+    return any(file_path in index.get_files(subject) for subject in subjects)
+
+def get_usages_in_folders(subject, folders, settings = None, token = None, on_progress = None, buffers = None):
     """
     Naive approach: reads all files and parses them.
     """
 
-    usage_list = []
+    settings = settings or utils.get_settings()
+    file_paths = list_files_in_folders(folders, settings)
+    scan = lambda file_path: scan_file(file_path, subject, graph_based=False, buffers=buffers, settings=settings)
+    return collect_usages(scan, file_paths, token, on_progress, settings=settings)
 
+def list_files_in_folders(folders, settings):
+    "Return the paths of all files in `folders` that pass the file and folder filters, in a stable order"
+    file_paths = []
     for folder in folders:
         for root, dirs, files in os.walk(folder, True):
-            files = [f for f in files if f[0] != '.' and utils.file_filter(f)]
-            dirs[:] = [d for d in dirs if d[0] != '.' and utils.folder_filter(d)]
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                try:
-                    usages = get_usages_in_file(file_path, subject)
-                    usage_list.extend(usages)
-                except UnicodeDecodeError:
-                    utils.log("Failed to open file", file_name, warning=True)
-                except FileNotFoundError:
-                    utils.log("File not found", file_name, warning=True)
-                    utils.log("Probably the file has been (re)moved and the dependency graph is stale. Please rebuild!", warning=True)
+            files = [f for f in files if f[0] != '.' and settings.file_filter(f)]
+            dirs[:] = [d for d in dirs if d[0] != '.' and settings.folder_filter(d)]
+            dirs.sort()
+            file_paths.extend(os.path.join(root, file_name) for file_name in sorted(files))
+    return file_paths
 
-    return usage_list
+def get_usages_of_subjects(subjects, files, index = None, token = None, on_progress = None, graph_based = True, settings = None,
+        buffers = None):
+    """
+    Batch approach: find the usages of several subjects at once, scanning each file once.
+    Returns {subject: [usage, ...]} or None if `token` got cancelled in the meantime.
+    """
+    settings = settings or utils.get_settings()
+    subjects = list(dict.fromkeys(subjects))
+    identifiers = [subject for subject in subjects if is_identifier(subject)]
+    others = [subject for subject in subjects if not is_identifier(subject)]
+    subjects_re = identifiers and lexer.compile_subjects(identifiers)
+
+    def scan(file_path):
+        pairs = []
+        if identifiers:
+            pairs.extend(get_usages_of_identifiers_in_file(file_path, identifiers, subjects_re, index, buffers, settings))
+        for subject in others:
+            pairs.extend((subject, usage) for usage in get_usages_in_lines(file_path, subject, buffers, settings))
+        return pairs
+
+    select = None
+    if index is not None and not others:
+        select = lambda file_path: index_may_contain(index, file_path, identifiers, buffers)
+    pairs = collect_usages(lambda file_path: scan_safely(scan, file_path, graph_based), files, token, on_progress,
+        select=select, settings=settings)
+    if pairs is None: return None
+    usages = {subject: [] for subject in subjects}
+    for (subject, usage) in pairs:
+        usages[subject].append(usage)
+    return usages
+
+def get_imports_in_file(file_path, settings = None, dir_index = None):
+    """
+    Return (deps, bindings): the files imported by `file_path` and the (imported, local) name
+    pairs imported from each of them ({dep: pairs}, only for deps whose imports are all understood).
+    """
+    settings = settings or utils.get_settings()
+    parsed = get_parsed_file(file_path, settings=settings)
+    paths = utils.expand_aliases(list(parsed['imports']), settings)
+    dir_path = os.path.dirname(file_path)
+    deps = {}
+    with stats.span('resolve_imports'):
+        for (path, pairs) in zip(paths, parsed['bindings']):
+            # Paths are resolved one by one to tell which names come from which file
+            for dep in utils.resolve_dep_paths([path], dir_path, settings.file_filter, settings.folder_filter, settings, dir_index):
+                if dep == file_path: continue
+                if pairs is None or deps.get(dep, []) is None:
+                    deps[dep] = None
+                else:
+                    deps[dep] = deps.get(dep, []) + [pair for pair in pairs if pair not in deps.get(dep, [])]
+    bindings = {dep: pairs for (dep, pairs) in deps.items() if pairs is not None}
+    return (list(deps), bindings)
 
-def get_dependencies_in_file(file_path):
+def find_visible_names(g, file_path, subject, settings = None):
+    """
+    Follow the imports of `subject`, defined in `file_path`, through the dependants of the file.
+    Returns {path: names}: the files that can see the subject and the local names it goes by in
+    each of them. Edges whose bindings aren't known and namespace imports pass all names on, as
+    do default imports of a file whose default export isn't recognized (the subject may be it).
+    Re-exports are only followed when they keep the name (`export ... from` isn't an import).
+    """
+    graph = g['graph']
     try:
-        with open(file_path, 'r', encoding='utf8') as f:
-            deps = find_imports_in_file(f)
-            utils.expand_aliases(deps)
-            dir_path = os.path.dirname(file_path)
-            deps = list(set(utils.resolve_dep_paths(deps, dir_path, utils.file_filter, utils.folder_filter)))
-            if file_path in deps: del deps[deps.index(file_path)]
-            return deps
-    except UnicodeDecodeError:
-        utils.log("Failed to open file", file_path, warning=True)
+        default_exports = lexer.find_default_exports(get_parsed_file(file_path, settings=settings)['code'])
+    except OSError:
+        default_exports = None
 
-def build_graph(g_to_build, folders, **kwargs):
-    """Build a whole new dependency graph"""
+    def local_names(bindings, names, from_definition):
+        if bindings is None: return set(names)
+        found = set()
+        for (imported, local) in bindings:
+            if imported == '*' or imported in names:
+                found.update(names if imported == '*' else [local])
+            elif imported == 'default':
+                if not from_definition:
+                    if local in names: found.add(local)
+                elif not default_exports or default_exports & names:
+                    found.add(local)
+        return found
+
+    visible = {file_path: {subject}}
+    queue = deque([file_path])
+    while queue:
+        dependee = queue.popleft()
+        names = visible[dependee]
+        for dependant in graph.get_direct_dependants(dependee):
+            found = local_names(graph.get_bindings(dependant, dependee), names, dependee == file_path)
+            if not found or found <= visible.get(dependant, set()): continue
+            visible.setdefault(dependant, set()).update(found)
+            queue.append(dependant)
+    return {path: tuple(sorted(names)) for (path, names) in visible.items()}
+
+def index_file(index, file_path, settings = None):
+    """(Re)index the usages in a single file"""
+    try:
+        index.set_file(file_path, get_postings_in_file(file_path, settings=settings), get_fingerprint(file_path, settings=settings))
+    except FileNotFoundError:
+        index.remove_file(file_path)
+
+def create_index(project_name = None):
+    """Return a new usage index or None if the index is disabled"""
+    if utils.get_setting('disable_usage_index', False, project_name): return None
+    return UsageIndex()
+
+def find_files(folders, settings, dir_index):
+    """
+    Generator yielding the paths of all files in `folders` that pass the file and folder filters.
+    Walks through `dir_index` so the listings can be re-used for resolving imports.
+    """
     for folder in folders:
-        for root, dirs, files in os.walk(folder, True):
-            files = [f for f in files if f[0] != '.' and utils.file_filter(f)]
-            dirs[:] = [d for d in dirs if d[0] != '.' and utils.folder_filter(os.path.join(root, d))]
+        for root, dirs, files in dir_index.walk(folder):
+            files = [f for f in files if f[0] != '.' and settings.file_filter(f)]
+            dirs[:] = [d for d in dirs if d[0] != '.' and settings.folder_filter(os.path.join(root, d))]
             for file_name in files:
-                file_path = os.path.join(root, file_name)
-                deps = get_dependencies_in_file(file_path)
-                g_to_build['graph'].add(file_path, deps)
+                yield os.path.join(root, file_name)
+
+def process_file(file_path, settings, dir_index, index = None):
+    """
+    Scan a single file for the graph (and the usage index).
+    Returns (file_path, deps, bindings, stat) where stat is the file's manifest entry.
+    """
+    try:
+        stat = get_fingerprint(file_path, settings=settings)
+        (deps, bindings) = get_imports_in_file(file_path, settings, dir_index)
+    except FileNotFoundError:
+        return (file_path, None, None, None)
+    if index is not None:
+        index_file(index, file_path, settings)
+    return (file_path, deps, bindings, stat)
+
+def build_graph(g_to_build, folders, **kwargs):
+    """
+    Build a whole new dependency graph.
+
+    Works as a pipeline: this thread enumerates the files and is the single writer
+    merging edges into the graph while a pool of `scan_workers` threads extracts and
+    resolves the imports of each file.
+    """
+    settings = kwargs.get('settings') or utils.get_settings()
+    dir_index = utils.DirIndex()
+    progress = g_to_build['progress'] = {'files_found': 0, 'files_done': 0}
+    manifest = g_to_build['manifest'] = {}
+    index = g_to_build.get('index')
+    num_workers = max(settings.get('scan_workers', 4) or 1, 1)
+
+    def merge(future):
+        (file_path, deps, bindings, stat) = future.result()
+        if deps: g_to_build['graph'].set(file_path, deps, bindings)
+        if stat: manifest[file_path] = stat
+        progress['files_done'] += 1
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        for file_path in find_files(folders, settings, dir_index):
+            pending.append(pool.submit(process_file, file_path, settings, dir_index, index))
+            progress['files_found'] += 1
+            # Merge whatever is done, blocking when too far ahead of the workers
+            while pending and (pending[0].done() or len(pending) > num_workers * 4):
+                merge(pending.popleft())
+        while pending:
+            merge(pending.popleft())
 
     g_to_build['last_update'] = time.time()
     if kwargs.get('on_complete'): kwargs.get('on_complete')()
 
+def get_changed_files(manifest, folders, settings, dir_index):
+    """
+    Diff the files currently in `folders` against `manifest`.
+    Returns (changed, removed, touched): files that were added or modified, files that are gone
+    and {file_path: new manifest entry} for files with a new mtime but the same contents.
+    """
+    changed = []
+    touched = {}
+    seen = set()
+    for file_path in find_files(folders, settings, dir_index):
+        seen.add(file_path)
+        try:
+            recorded = manifest.get(file_path)
+            stat = check_stat(file_path, recorded)
+        except OSError:
+            continue
+        if stat is None:
+            changed.append(file_path)
+        elif stat is not recorded:
+            touched[file_path] = stat
+    removed = [file_path for file_path in manifest if file_path not in seen]
+    return (changed, removed, touched)
+
+def update_files(g, changed, removed, settings, dir_index):
+    """
+    Re-scan `changed` files and drop `removed` ones, replacing their edges in the graph.
+    Direct dependants of removed files are re-scanned too as their imports may resolve differently now.
+    """
+    graph = g['graph']
+    manifest = g.setdefault('manifest', {})
+    index = g.get('index')
+    changed = set(changed)
+
+    for file_path in removed:
+        changed.update(graph.get_direct_dependants(file_path))
+        graph.remove(file_path)
+        manifest.pop(file_path, None)
+        if index is not None: index.remove_file(file_path)
+    changed.difference_update(removed)
+
+    for (file_path, deps, bindings, stat) in map_files(lambda file_path: process_file(file_path, settings, dir_index, index), sorted(changed), settings):
+        if stat is None:
+            graph.remove(file_path)
+            manifest.pop(file_path, None)
+            continue
+        graph.set(file_path, deps or [], bindings)
+        manifest[file_path] = stat
+
+    g['last_update'] = time.time()
+
+def apply_changes(g, project_name, changed, removed, dir_index = None):
+    """Update graph `g` for a batch of changed and removed files and journal the changes"""
+    operation = stats.operation('refresh', project_name)
+    cache = get_parse_cache()
+    for file_path in changed + removed:
+        cache.invalidate(file_path)
+    update_files(g, changed, removed, utils.get_settings(project_name), dir_index or utils.shared_dir_index)
+    utils.save_graph_changes(g, project_name, sorted(set(changed) | set(removed)))
+    if g.get('index') is not None:
+        utils.save_index_changes(g['index'], project_name)
+    operation.finish(changed=len(changed), removed=len(removed))
+
+def refresh_graph(g, folders, project_name):
+    """Bring a graph loaded from cache up to date with the files on disk"""
+    dir_index = utils.DirIndex()
+    (changed, removed, touched) = get_changed_files(g.get('manifest', {}), folders, utils.get_settings(project_name), dir_index)
+    if touched:
+        # Only the mtimes changed, e.g. on a fresh checkout: record them so the files aren't hashed again
+        g['manifest'].update(touched)
+        utils.save_graph_changes(g, project_name, sorted(touched))
+        utils.log("Kept %d files of %s with new mtimes but unchanged contents" % (len(touched), project_name), project_name=project_name)
+    if not changed and not removed: return
+    utils.log("Refreshing graph for %s: %d changed and %d removed files" % (project_name, len(changed), len(removed)), project_name=project_name)
+    apply_changes(g, project_name, changed, removed, dir_index)
+    enforce_graph_budget()
+
+def refresh_files(project_name, changed, removed = []):
+    """Refresh a batch of files that were changed outside of the editor"""
+    g = graphs.peek(project_name)
+    if not g: return
+    apply_changes(g, project_name, list(changed), list(removed))
+    enforce_graph_budget()
+
+def get_manifest(project_name):
+    g = graphs.peek(project_name)
+    return g and g.get('manifest')
+
+def get_graph_state(project_name):
+    if project_name in graphs: return READY
+    return graph_states.get(project_name, NOT_LOADED)
+
+def set_graph_state(project_name, state):
+    """
+    Update the loading state of a project's graph. Once it's READY (or NOT_LOADED again
+    after a failure) the callbacks waiting for it are called on the main thread with the
+    graph, or None if there is none.
+    """
+    with graph_lock:
+        graph_states[project_name] = state
+        waiters = graph_waiters.pop(project_name, []) if state in (READY, NOT_LOADED) else []
+    utils.log('Graph for %s: %s' % (project_name, state), project_name=project_name)
+    for on_ready in waiters:
+        sublime.set_timeout(lambda on_ready=on_ready: on_ready(graphs.get(project_name)), 0)
+
+def request_graph(project_name, on_ready = None):
+    """
+    Make sure a project's graph gets loaded without blocking: starts loading it from cache in the
+    background unless it's ready or already loading/building. `on_ready(g)` is called on the main
+    thread once the graph is ready (or with None if it couldn't be loaded).
+    Returns the state the graph was in.
+    """
+    with graph_lock:
+        state = get_graph_state(project_name)
+        if state == READY:
+            waiter = on_ready
+        else:
+            waiter = None
+            if on_ready: graph_waiters.setdefault(project_name, []).append(on_ready)
+            if state == NOT_LOADED: graph_states[project_name] = LOADING
+    if waiter:
+        sublime.set_timeout(lambda: waiter(graphs.get(project_name)), 0)
+    elif state == NOT_LOADED:
+        threading.Thread(target=load_graph, args=[project_name]).start()
+    return state
+
+def register_graph(project_name, g):
+    """Make a loaded or freshly built graph available for lookups and start watching its folders"""
+    graphs.set(project_name, g)
+    set_graph_state(project_name, READY)
+    enforce_graph_budget()
+    watcher.watch(project_name, utils.get_project_folders(project_name),
+        lambda: get_manifest(project_name), refresh_files)
+
+def clear_graphs():
+    with graph_lock:
+        graphs.clear()
+        graph_states.clear()
+
+def enforce_graph_budget():
+    """Evict the least recently used graphs once they take more than `graph_memory_budget_mb`"""
+    graphs.enforce_budget(utils.get_setting('graph_memory_budget_mb', 256) * 1024 * 1024)
+
 def refresh_dependencies(file_path, project_name):
     """
     Refresh the dependencies of a single file in the graph and save the graph
     to the cache if the deps have changed.
     """
-    global graphs
-    g = graphs.get(project_name, {})
+    g = graphs.peek(project_name, {})
 
-    utils.log("Refreshing deps for file", file_path)
+    utils.log("Refreshing deps for file", file_path, project_name=project_name)
 
     if not g:
-        utils.log('Cannot refresh dependencies for file "%s", graph for project "%s" does not exist: loading graph' % (file_path, project_name))
-        load_graph(project_name)
+        # Refreshing the graph once it's loaded picks up the change
+        utils.log('Not refreshing dependencies for file "%s", graph for project "%s" is not loaded' % (file_path, project_name), project_name=project_name)
         return
 
-    direct_deps = get_dependencies_in_file(file_path)
-    current_deps = g['graph'].get_dependees(file_path)
-    g['graph'].set(file_path, direct_deps)
+    settings = utils.get_settings(project_name)
+    (direct_deps, bindings) = get_imports_in_file(file_path, settings)
+    current_deps = set(g['graph'].get_direct_dependees(file_path))
+    g['graph'].set(file_path, direct_deps or [], bindings)
     g['last_update'] = time.time()
+    try:
+        g.setdefault('manifest', {})[file_path] = get_fingerprint(file_path, settings=settings)
+    except OSError:
+        pass
 
-    # Update cache if graph changed
-    if g['graph'].get_dependees(file_path) != current_deps:
-        utils.save_graph(g, project_name)
+    # Journal the new deps and manifest entry, which costs a single small append
+    utils.save_graph_changes(g, project_name, [file_path])
+    if set(g['graph'].get_direct_dependees(file_path)) != current_deps:
+        utils.log("Dependencies changed for file", file_path, project_name=project_name)
+
+    if g.get('index') is not None:
+        index_file(g['index'], file_path, settings)
+        utils.save_index_changes(g['index'], project_name)
 
 def load_graph(project_name):
-    """Attempt to load a graph from cache. If none is found attempt to build it"""
-    global graphs
-    utils.log("Loading graph from cache for project %s" % project_name)
-    g = utils.load_graph(project_name)
-    if not g or g['graph'].num_deps == 0:
-        utils.log("No graph in cache for %s: rebuilding" % project_name)
-        sublime.active_window().run_command('goto_usage_build_graph', {'project_name': project_name})
-    else:
-        utils.log("Got %d dependencies from cache for %s" % (g['graph'].num_deps, project_name))
-        if g['last_update'] < time.time() - 1000 * 60 * 60 * 24:
-            utils.log("Graph older than 24h, rebuilding")
-            sublime.active_window().run_command('goto_usage_build_graph', {'project_name': project_name})
-        else:
-            graphs[project_name] = g
+    """
+    Load a graph from cache and bring it up to date with the files on disk. If none is found
+    have it built. Runs in the background, see `request_graph`.
+    """
+    utils.log("Loading graph from cache for project %s" % project_name, project_name=project_name)
+    try:
+        g = utils.load_graph(project_name)
+        if not g or g['graph'].num_deps == 0:
+            utils.log("No graph in cache for %s: rebuilding" % project_name, project_name=project_name)
+            set_graph_state(project_name, BUILDING)
+            sublime.set_timeout(lambda: sublime.active_window().run_command(
+                'goto_usage_build_graph', {'project_name': project_name}), 0)
+            return
+        utils.log("Got %d dependencies from cache for %s" % (g['graph'].num_deps, project_name), project_name=project_name)
+        if not utils.get_setting('disable_usage_index', False, project_name):
+            g['index'] = utils.load_index(project_name) or UsageIndex()
+    except Exception:
+        set_graph_state(project_name, NOT_LOADED)
+        raise
+    register_graph(project_name, g)
+    # Pick up files changed while the editor was closed (or outside of it). Without an open window
+    # of the project its folders are unknown, which must not be mistaken for all files being removed
+    folders = utils.get_project_folders(project_name)
+    if folders: refresh_graph(g, folders, project_name)
 
 def ensure_graph_exists(project_name):
-    global graphs
-    g = graphs.get(project_name)
-    if not g:
-        load_graph(project_name)
-
-def load_all_graphs():
-    project_names = utils.get_all_project_names()
-    for project_name in project_names: load_graph(project_name)
+    request_graph(project_name)
 
 open_callbacks = []
 
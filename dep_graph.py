@@ -1,89 +1,389 @@
+import threading
+from array import array
+from collections import OrderedDict
+
+# Rough CPython costs in bytes, used to estimate the memory held by a graph
+NODE_BYTES = 160 # Path string header, id map entry and node list slot
+EDGE_BYTES = 80 # An entry in the sets of both directions
+SET_BYTES = 216
+MEMO_PATH_BYTES = 8
+BINDING_BYTES = 120 # An edge's entry and (imported, local) tuples
+
+# Number of components whose transitive dependants are remembered
+MEMO_SIZE = 256
 
 class DepGraph:
     """
     Simple dependency graph implementation.
-    Nodes are strings.
+    Nodes are strings, interned to integer ids internally. Edges are stored
+    as sets of ids in both directions so that lookups and updates are O(1).
+    All public methods are safe to call from multiple threads.
+
+    For `get_dependants` the graph is condensed into its strongly connected components
+    (import cycles) once, and the dependants found per component are memoized. Edge
+    changes update the condensation in place and only drop the memoized dependants that
+    they affect; only removing an edge within a cycle, which may split it, or closing
+    a new cycle recomputes the condensation on the next lookup.
+
+    Edges may carry the names the dependant imports from the dependee as a tuple of
+    (imported name, local name) pairs (see `lexer.parse_bindings`). Edges without
+    bindings import names that aren't known.
 
     glossary:
     dependant imports the dependee
     """
 
-    def __init__(self, loop_limit = 50):
-        self.loop_limit = loop_limit
-        self.num_deps = 0
+    def __init__(self):
+        self.lock = threading.RLock()
         self.clear()
 
     def clear(self):
+        self.node_ids = {}
+        self.nodes = []
         self.forward_graph = {}
         self.backward_graph = {}
         self.num_deps = 0
+        self.path_bytes = 0
+        self.bindings = {} # (dependant id, dependee id) -> ((imported, local), ...)
+        self._drop_condensation()
+
+    def _drop_condensation(self):
+        self.component = None # Node id -> component id, None until condensed
+        self.members = {}
+        self.cyclic = set()
+        self.comp_dependees = {} # Component id -> {dependee component id: number of edges}
+        self.comp_dependants = {}
+        self.memo = OrderedDict() # Component id -> (dependant component ids, dependant paths)
+
+    def _intern(self, node):
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            node_id = self.node_ids[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.path_bytes += len(node)
+            if self.component is not None:
+                # A new node is a component of its own
+                comp = self.component[node_id] = self.next_comp
+                self.members[comp] = [node_id]
+                self.next_comp += 1
+        return node_id
 
     def add(self, dependant, dependee):
+        with self.lock:
+            self._add(dependant, dependee)
+
+    def _add(self, dependant, dependee):
 
         # In case of list passed as dependee, add all
-        if type(dependee) in [list, tuple]:
+        if type(dependee) in [list, tuple, set]:
             for d in dependee:
-                self.add(dependant, d)
+                self._add(dependant, d)
             return
 
-        self.num_deps += 1
+        dependant_id = self._intern(dependant)
+        dependee_id = self._intern(dependee)
 
+        self._link(dependant_id, dependee_id)
+
+    def _link(self, dependant_id, dependee_id):
         # Store dependant -> dependee
-        if dependant not in self.forward_graph:
-            self.forward_graph[dependant] = []
-        if dependee not in self.forward_graph[dependant]:
-            self.forward_graph[dependant].append(dependee)
+        dependees = self.forward_graph.setdefault(dependant_id, set())
+        if dependee_id in dependees: return
+        dependees.add(dependee_id)
         # Store dependee -> dependant
-        if dependee not in self.backward_graph:
-            self.backward_graph[dependee] = []
-        if dependant not in self.backward_graph[dependee]:
-            self.backward_graph[dependee].append(dependant)
+        self.backward_graph.setdefault(dependee_id, set()).add(dependant_id)
+        self.num_deps += 1
+        if self.component is not None:
+            self._link_components(dependant_id, dependee_id)
 
-    def set(self, dependant, dependee):
+    def _unlink(self, dependant_id, dependee_id):
+        dependees = self.forward_graph[dependant_id]
+        dependees.discard(dependee_id)
+        if not dependees: del self.forward_graph[dependant_id]
+        dependants = self.backward_graph[dependee_id]
+        dependants.discard(dependant_id)
+        if not dependants: del self.backward_graph[dependee_id]
+        self.bindings.pop((dependant_id, dependee_id), None)
+        self.num_deps -= 1
+        if self.component is not None:
+            self._unlink_components(dependant_id, dependee_id)
 
-        # Clear list
+    def set(self, dependant, dependee, bindings = None):
+        """
+        Replace the dependees of `dependant`. `bindings` maps dependees to the
+        (imported, local) name pairs imported from them, if known.
+        """
 
-        if dependant in self.forward_graph:
-            self.num_deps -= len(self.forward_graph[dependant])
-            self.forward_graph[dependant] = []
+        with self.lock:
+            if type(dependee) not in [list, tuple, set]:
+                dependee = [dependee]
+            if not dependee and dependant not in self.node_ids: return
+            dependant_id = self._intern(dependant)
+            dependee_ids = set(self._intern(d) for d in dependee)
 
-        # Add new deps
-        # In case of list passed as dependee, set all
-        if type(dependee) in [list, tuple]:
-            for d in dependee:
-                self.add(dependant, d)
-        else:
-            self.add(dependant, dependee)
+            # Only touch the edges that changed so unchanged files don't invalidate anything
+            for dependee_id in list(self.forward_graph.get(dependant_id, ())):
+                if dependee_id not in dependee_ids:
+                    self._unlink(dependant_id, dependee_id)
+            for dependee_id in dependee_ids:
+                self._link(dependant_id, dependee_id)
+                pairs = bindings.get(self.nodes[dependee_id]) if bindings else None
+                if pairs is None:
+                    self.bindings.pop((dependant_id, dependee_id), None)
+                else:
+                    self.bindings[(dependant_id, dependee_id)] = tuple(tuple(pair) for pair in pairs)
+
+    def remove(self, node):
+        """Remove a node and all edges to and from it"""
+        with self.lock:
+            node_id = self.node_ids.get(node)
+            if node_id is None: return
+            for dependee_id in list(self.forward_graph.get(node_id, ())):
+                self._unlink(node_id, dependee_id)
+            for dependant_id in list(self.backward_graph.get(node_id, ())):
+                self._unlink(dependant_id, node_id)
+
+    def get_direct_dependants(self, dependee):
+        return self._neighbours(self.backward_graph, dependee)
+
+    def get_direct_dependees(self, dependant):
+        return self._neighbours(self.forward_graph, dependant)
+
+    def get_bindings(self, dependant, dependee):
+        """Return the (imported, local) name pairs `dependant` imports from `dependee`, None if not known"""
+        with self.lock:
+            dependant_id = self.node_ids.get(dependant)
+            dependee_id = self.node_ids.get(dependee)
+            return self.bindings.get((dependant_id, dependee_id))
+
+    def get_edge_bindings(self):
+        """Return the bindings of all edges as [dependant id, dependee id, pairs] for `set_edge_bindings`"""
+        with self.lock:
+            return [[dependant_id, dependee_id, pairs] for ((dependant_id, dependee_id), pairs) in self.bindings.items()]
+
+    def set_edge_bindings(self, edge_bindings):
+        """Set the bindings of edges by node id, e.g. after `set_edges`"""
+        with self.lock:
+            for (dependant_id, dependee_id, pairs) in edge_bindings:
+                if dependee_id in self.forward_graph.get(dependant_id, ()):
+                    self.bindings[(dependant_id, dependee_id)] = tuple(tuple(pair) for pair in pairs)
 
     def get_dependants(self, dependee):
-        return self._traverse_graph(self.backward_graph, dependee)
+        """
+        Return all nodes depending on `dependee` directly or indirectly (itself only if it's part of a cycle),
+        nearest first: ordered by the number of imports between their components and that of `dependee`.
+        """
+        with self.lock:
+            node_id = self.node_ids.get(dependee)
+            if node_id is None: return []
+            if self.component is None:
+                self._condense()
+            comp = self.component[node_id]
+            if comp in self.memo:
+                self.memo.move_to_end(comp)
+            else:
+                self.memo[comp] = self._find_dependants(comp)
+                if len(self.memo) > MEMO_SIZE:
+                    self.memo.popitem(last=False)
+            return list(self.memo[comp][1])
 
     def get_dependees(self, dependant):
         return self._traverse_graph(self.forward_graph, dependant)
 
+    def memory_size(self):
+        """Estimate the memory held by the graph in bytes"""
+        with self.lock:
+            memo_paths = sum(len(paths) for (comps, paths) in self.memo.values())
+        return len(self.nodes) * NODE_BYTES + self.path_bytes + self.num_deps * EDGE_BYTES + \
+            (len(self.forward_graph) + len(self.backward_graph)) * SET_BYTES + memo_paths * MEMO_PATH_BYTES + \
+            len(self.bindings) * BINDING_BYTES
+
     def get_data(self):
-        return {
-            'forward': self.forward_graph,
-            'backward': self.backward_graph
-        }
+        with self.lock:
+            return {
+                'forward': self._export(self.forward_graph),
+                'backward': self._export(self.backward_graph)
+            }
 
     def set_data(self, data):
-        self.forward_graph = data.get('forward', {})
-        self.backward_graph = data.get('backward', {})
-        self.num_deps = len([dep for deps in self.forward_graph.values() for dep in deps])
+        # The backward graph is derived from the forward one so they can't disagree
+        with self.lock:
+            self.clear()
+            for dependant, dependees in data.get('forward', {}).items():
+                self._add(dependant, dependees)
+
+    def get_edges(self):
+        """Return (nodes, edges): the node list and a flat array of (dependant id, dependee id) pairs"""
+        with self.lock:
+            edges = array('I')
+            for dependant_id, dependee_ids in self.forward_graph.items():
+                for dependee_id in dependee_ids:
+                    edges.append(dependant_id)
+                    edges.append(dependee_id)
+            return (list(self.nodes), edges)
+
+    def set_edges(self, nodes, edges):
+        """Replace the graph with the output of `get_edges`"""
+        with self.lock:
+            self.clear()
+            self.nodes = list(nodes)
+            self.node_ids = {node: i for i, node in enumerate(self.nodes)}
+            self.path_bytes = sum(len(node) for node in self.nodes)
+            forward_graph = self.forward_graph
+            backward_graph = self.backward_graph
+            for i in range(0, len(edges), 2):
+                forward_graph.setdefault(edges[i], set()).add(edges[i + 1])
+                backward_graph.setdefault(edges[i + 1], set()).add(edges[i])
+            self.num_deps = sum(len(ids) for ids in forward_graph.values())
+
+    def _export(self, graph):
+        nodes = self.nodes
+        return {nodes[i]: [nodes[j] for j in ids] for i, ids in graph.items()}
+
+    def _neighbours(self, graph, subject):
+        with self.lock:
+            subject_id = self.node_ids.get(subject)
+            if subject_id is None: return []
+            return [self.nodes[i] for i in graph.get(subject_id, ())]
 
     def _traverse_graph(self, graph, subject):
-        results = []
-        subjects = [subject] # For loop instead of recursion
-        for i in range(self.loop_limit):
-            current_results = []
-            for s in subjects:
-                current_results.extend([i for i in graph.get(s, []) if i not in results])
-            if not current_results: break
-            subjects = current_results
-            results.extend(current_results)
-        results = list(set(results))
-        return results
+        """Breadth-first search for all nodes reachable from `subject`"""
+        with self.lock:
+            subject_id = self.node_ids.get(subject)
+            if subject_id is None: return []
+            results = set()
+            subjects = [subject_id] # For loop instead of recursion
+            while subjects:
+                current_results = []
+                for s in subjects:
+                    for n in graph.get(s, ()):
+                        if n in results: continue
+                        results.add(n)
+                        current_results.append(n)
+                subjects = current_results
+            return [self.nodes[i] for i in results]
+
+    def _condense(self):
+        """Find the strongly connected components with Tarjan's algorithm (iteratively) and the edges between them"""
+        self._drop_condensation()
+        forward_graph = self.forward_graph
+        component = {}
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        for root in range(len(self.nodes)):
+            if root in index: continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(forward_graph.get(root, ())))]
+            while work:
+                (node_id, dependee_ids) = work[-1]
+                for dependee_id in dependee_ids:
+                    if dependee_id not in index:
+                        index[dependee_id] = low[dependee_id] = len(index)
+                        stack.append(dependee_id)
+                        on_stack.add(dependee_id)
+                        work.append((dependee_id, iter(forward_graph.get(dependee_id, ()))))
+                        break
+                    if dependee_id in on_stack:
+                        low[node_id] = min(low[node_id], index[dependee_id])
+                else:
+                    work.pop()
+                    if work:
+                        parent_id = work[-1][0]
+                        low[parent_id] = min(low[parent_id], low[node_id])
+                    if low[node_id] == index[node_id]:
+                        comp = len(self.members)
+                        members = self.members[comp] = []
+                        while True:
+                            member_id = stack.pop()
+                            on_stack.discard(member_id)
+                            component[member_id] = comp
+                            members.append(member_id)
+                            if member_id == node_id: break
+                        if len(members) > 1: self.cyclic.add(comp)
+        self.component = component
+        self.next_comp = len(self.members)
+        for (dependant_id, dependee_ids) in forward_graph.items():
+            for dependee_id in dependee_ids:
+                self._link_components(dependant_id, dependee_id)
+
+    def _link_components(self, dependant_id, dependee_id):
+        (dependant_comp, dependee_comp) = (self.component[dependant_id], self.component[dependee_id])
+        if dependant_comp == dependee_comp:
+            # Within a cycle nothing changes, a self import makes a node its own dependant
+            if dependant_comp not in self.cyclic:
+                self.cyclic.add(dependant_comp)
+                self.memo.pop(dependant_comp, None)
+            return
+        dependees = self.comp_dependees.setdefault(dependant_comp, {})
+        if dependee_comp in dependees:
+            # Components already connected, the dependants don't change
+            dependees[dependee_comp] += 1
+            self.comp_dependants[dependee_comp][dependant_comp] += 1
+            return
+        if self._reaches(dependee_comp, dependant_comp):
+            # Closes a cycle which merges components
+            self._drop_condensation()
+            return
+        dependees[dependee_comp] = 1
+        self.comp_dependants.setdefault(dependee_comp, {})[dependant_comp] = 1
+        self._invalidate(dependee_comp)
+
+    def _unlink_components(self, dependant_id, dependee_id):
+        (dependant_comp, dependee_comp) = (self.component[dependant_id], self.component[dependee_id])
+        if dependant_comp == dependee_comp:
+            if len(self.members[dependant_comp]) > 1:
+                # May split the cycle
+                self._drop_condensation()
+            else:
+                self.cyclic.discard(dependant_comp)
+                self.memo.pop(dependant_comp, None)
+            return
+        dependees = self.comp_dependees[dependant_comp]
+        dependants = self.comp_dependants[dependee_comp]
+        dependees[dependee_comp] -= 1
+        dependants[dependant_comp] -= 1
+        if dependees[dependee_comp]: return
+        del dependees[dependee_comp]
+        del dependants[dependant_comp]
+        self._invalidate(dependee_comp)
+
+    def _invalidate(self, dependee_comp):
+        """Forget the memoized dependants of the components that `dependee_comp` depends on (and its own)"""
+        for comp in [comp for (comp, (comps, paths)) in self.memo.items() if comp == dependee_comp or dependee_comp in comps]:
+            del self.memo[comp]
+
+    def _reaches(self, from_comp, to_comp):
+        """Return True if `from_comp` depends on `to_comp` directly or indirectly"""
+        seen = set([from_comp])
+        todo = [from_comp]
+        while todo:
+            for comp in self.comp_dependees.get(todo.pop(), ()):
+                if comp == to_comp: return True
+                if comp in seen: continue
+                seen.add(comp)
+                todo.append(comp)
+        return False
+
+    def _find_dependants(self, comp):
+        """Return (component ids, paths) of the components depending on `comp`, breadth-first"""
+        found = [comp] if comp in self.cyclic else []
+        comps = set(found)
+        level = [comp]
+        while level:
+            next_level = []
+            for c in level:
+                for dependant_comp in self.comp_dependants.get(c, ()):
+                    if dependant_comp in comps: continue
+                    comps.add(dependant_comp)
+                    next_level.append(dependant_comp)
+            found.extend(next_level)
+            level = next_level
+        nodes = self.nodes
+        return (comps, [nodes[i] for c in found for i in self.members[c]])
 
 
 if __name__ == "__main__":
@@ -95,8 +395,64 @@ if __name__ == "__main__":
     graph.add('a', 'c')
     graph.add('b', 'c')
     graph.add('b', 'd')
+    graph.add('b', 'd')
 
+    assert graph.num_deps == 4
     assert sorted(graph.get_dependees('a')) == ['b', 'c', 'd']
     assert sorted(graph.get_dependees('b')) == ['c', 'd']
     assert sorted(graph.get_dependants('c')) == ['a', 'b']
     assert sorted(graph.get_dependants('d')) == ['a', 'b']
+
+    graph.set('b', ['d'])
+    assert graph.num_deps == 3
+    assert sorted(graph.get_dependants('c')) == ['a']
+
+    copy = DepGraph()
+    copy.set_data(graph.get_data())
+    assert copy.num_deps == 3
+    assert sorted(copy.get_dependants('d')) == ['a', 'b']
+
+    copy = DepGraph()
+    copy.set_edges(*graph.get_edges())
+    assert copy.num_deps == 3
+    other = DepGraph()
+    other.set_data(graph.get_data())
+    assert copy.memory_size() == other.memory_size()
+    assert sorted(copy.get_dependants('d')) == ['a', 'b']
+
+    graph.remove('b')
+    assert graph.num_deps == 1
+    assert sorted(graph.get_dependees('a')) == ['c']
+    assert sorted(graph.get_dependants('d')) == []
+
+    # Cycles
+    graph = DepGraph()
+    graph.set('a', ['b'])
+    graph.set('b', ['c'])
+    graph.set('c', ['d'])
+    assert sorted(graph.get_dependants('d')) == ['a', 'b', 'c']
+    graph.set('c', ['d', 'a'])
+    assert sorted(graph.get_dependants('d')) == ['a', 'b', 'c']
+    assert sorted(graph.get_dependants('b')) == ['a', 'b', 'c']
+    graph.add('e', 'a')
+    assert sorted(graph.get_dependants('c')) == ['a', 'b', 'c', 'e']
+    assert graph.get_dependants('d')[-1] == 'e' # Nearest first
+    graph.set('c', ['d'])
+    assert sorted(graph.get_dependants('b')) == ['a', 'e']
+    assert sorted(graph.get_dependants('d')) == ['a', 'b', 'c', 'e']
+    graph.add('d', 'd')
+    assert sorted(graph.get_dependants('d')) == ['a', 'b', 'c', 'd', 'e']
+    graph.remove('b')
+    assert sorted(graph.get_dependants('d')) == ['c', 'd']
+
+    # Bindings
+    graph = DepGraph()
+    graph.set('a', ['b', 'c'], {'b': [('default', 'B')]})
+    assert graph.get_bindings('a', 'b') == (('default', 'B'),)
+    assert graph.get_bindings('a', 'c') is None
+    copy = DepGraph()
+    copy.set_edges(*graph.get_edges())
+    copy.set_edge_bindings(graph.get_edge_bindings())
+    assert copy.get_bindings('a', 'b') == (('default', 'B'),)
+    graph.set('a', ['c'])
+    assert graph.get_bindings('a', 'b') is None
@@ -0,0 +1,301 @@
+"""
+On-disk format of the dependency graph cache.
+
+A cache consists of a binary snapshot and an append-only journal:
+
+Snapshot: header | string table | manifest mtimes | manifest sizes | manifest hashes | edges | bindings
+    - header: magic, version, last_update, number of strings, size of the
+      string table, number of edges and size of the bindings
+    - string table: all paths once, utf8-encoded and joined with NUL bytes
+    - manifest: one double (mtime), one int64 (size) and one uint64 (content
+      hash, since version 3) per path, size -1 meaning the path has no manifest
+      entry and hash 0 that its contents weren't hashed
+    - edges: (dependant id, dependee id) pairs of uint32 indices into the string table
+    - bindings: the names imported along edges as a JSON list of
+      [dependant id, dependee id, [[imported, local], ...]] (since version 2)
+
+Journal: one JSON record per line describing the new state of a single file
+    {"path": ..., "deps": [...], "bindings": {dep: [[imported, local], ...]}, "stat": [mtime, size, hash], "time": ...}
+    {"path": ..., "removed": true, "time": ...}
+
+Saving a single file's changes appends one journal record. Once the journal
+grows large it is folded back into a new snapshot.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+MAGIC = b'GUGC'
+VERSION = 3
+HEADER = struct.Struct('<4sIdIIII')
+HEADER_V1 = struct.Struct('<4sIdIII') # Without bindings
+
+def _to_bytes(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def _pad(size):
+    return (8 - size % 8) % 8
+
+def take_snapshot(g):
+    """
+    Copy what `write_snapshot` writes of graph `g`, so that the snapshot can be written in the
+    background while the graph and its manifest keep changing
+    """
+    with g['graph'].lock:
+        (nodes, edges) = g['graph'].get_edges()
+        return {
+            'last_update': g['last_update'],
+            'nodes': nodes,
+            'edges': edges,
+            'bindings': g['graph'].get_edge_bindings(),
+            'manifest': dict(g.get('manifest', {}))
+        }
+
+def write_snapshot(path, snapshot):
+    """Atomically write a `take_snapshot` copy of a graph to `path`"""
+    (nodes, edges, manifest) = (snapshot['nodes'], snapshot['edges'], snapshot['manifest'])
+    strings = list(nodes)
+    string_ids = {s: i for i, s in enumerate(strings)}
+    for file_path in manifest:
+        if file_path not in string_ids:
+            string_ids[file_path] = len(strings)
+            strings.append(file_path)
+
+    mtimes = array('d', [0.0] * len(strings))
+    sizes = array('q', [-1] * len(strings))
+    hashes = array('Q', [0] * len(strings))
+    for file_path, stat in manifest.items():
+        i = string_ids[file_path]
+        mtimes[i] = stat[0]
+        sizes[i] = stat[1]
+        if len(stat) > 2: hashes[i] = stat[2]
+
+    blob = '\0'.join(strings).encode('utf8')
+    bindings = json.dumps(snapshot['bindings'], separators=(',',':')).encode('utf8')
+    write_atomically(path, [
+        HEADER.pack(MAGIC, VERSION, snapshot['last_update'] or 0.0, len(strings), len(blob), len(edges) // 2, len(bindings)),
+        blob,
+        b'\0' * _pad(len(blob)),
+        _to_bytes(mtimes),
+        _to_bytes(sizes),
+        _to_bytes(hashes),
+        _to_bytes(edges),
+        bindings
+    ])
+
+def write_atomically(path, chunks):
+    """
+    Write the byte strings `chunks` to `path` through a uniquely named temporary file next to it,
+    so that concurrent writers (e.g. the editor and the command line tool) never mix their output
+    """
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def read_snapshot(path, graph):
+    """
+    Read a snapshot into the empty DepGraph `graph`.
+    Returns (last_update, manifest) or raises ValueError if the file is not a valid snapshot.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise ValueError("Truncated graph snapshot")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            (magic, version) = struct.unpack_from('<4sI', data, 0)
+            if magic != MAGIC or version not in (1, 2, VERSION):
+                raise ValueError("Not a graph snapshot (or an outdated one)")
+            if version == 1:
+                (magic, version, last_update, num_strings, blob_size, num_edges) = HEADER_V1.unpack_from(data, 0)
+                (offset, bindings_size) = (HEADER_V1.size, 0)
+            else:
+                if len(data) < HEADER.size:
+                    raise ValueError("Truncated graph snapshot")
+                (magic, version, last_update, num_strings, blob_size, num_edges, bindings_size) = HEADER.unpack_from(data, 0)
+                offset = HEADER.size
+            strings = data[offset:offset + blob_size].decode('utf8').split('\0') if num_strings else []
+            offset += blob_size + _pad(blob_size)
+            mtimes = _from_bytes('d', data[offset:offset + 8 * num_strings])
+            offset += 8 * num_strings
+            sizes = _from_bytes('q', data[offset:offset + 8 * num_strings])
+            offset += 8 * num_strings
+            hashes = None
+            if version >= 3:
+                hashes = _from_bytes('Q', data[offset:offset + 8 * num_strings])
+                offset += 8 * num_strings
+            edges = _from_bytes('I', data[offset:offset + 8 * num_edges])
+            offset += 8 * num_edges
+            bindings = data[offset:offset + bindings_size]
+
+    if len(strings) != num_strings or (hashes is not None and len(hashes) != num_strings) or len(edges) != 2 * num_edges or len(bindings) != bindings_size:
+        raise ValueError("Truncated graph snapshot")
+
+    graph.set_edges(strings, edges)
+    if bindings_size:
+        graph.set_edge_bindings(json.loads(bindings.decode('utf8')))
+    manifest = {}
+    for i in range(num_strings):
+        if sizes[i] < 0: continue
+        manifest[strings[i]] = [mtimes[i], sizes[i], hashes[i]] if hashes and hashes[i] else [mtimes[i], sizes[i]]
+    return (last_update, manifest)
+
+def append_journal(path, records):
+    """Append change records to the journal at `path`"""
+    with open(path, 'a', encoding='utf8') as f:
+        f.write(''.join(json.dumps(record, separators=(',',':')) + '\n' for record in records))
+
+def replay_journal(path, g):
+    """
+    Apply the records of the journal at `path` to graph `g`.
+    Returns the number of records applied. A partially written last record is ignored.
+    """
+    try:
+        f = open(path, 'r', encoding='utf8')
+    except IOError:
+        return 0
+    num_records = 0
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record.get('removed'):
+                g['graph'].remove(record['path'])
+                g['manifest'].pop(record['path'], None)
+            else:
+                g['graph'].set(record['path'], record['deps'], record.get('bindings'))
+                if record.get('stat'): g['manifest'][record['path']] = record['stat']
+            g['last_update'] = max(g['last_update'] or 0, record.get('time', 0))
+            num_records += 1
+    return num_records
+
+def make_record(g, file_path, time):
+    """Describe the current state of `file_path` in graph `g` as a journal record"""
+    stat = g.get('manifest', {}).get(file_path)
+    if stat is None and not g['graph'].get_direct_dependees(file_path):
+        return {'path': file_path, 'removed': True, 'time': time}
+    deps = g['graph'].get_direct_dependees(file_path)
+    bindings = {}
+    for dep in deps:
+        pairs = g['graph'].get_bindings(file_path, dep)
+        if pairs is not None: bindings[dep] = pairs
+    return {
+        'path': file_path,
+        'deps': deps,
+        'bindings': bindings,
+        'stat': stat,
+        'time': time
+    }
+
+if __name__ == "__main__":
+
+    # Test: a graph saved as a snapshot, changed through the journal and loaded again equals a
+    # freshly built one. Run from the repository root: python graph_cache.py
+
+    import random
+    import tempfile
+    from tools import sublime_shim, synthetic
+
+    def describe(g):
+        (nodes, edges) = g['graph'].get_edges()
+        edge_bindings = {}
+        for i in range(0, len(edges), 2):
+            (dependant, dependee) = (nodes[edges[i]], nodes[edges[i + 1]])
+            edge_bindings[(dependant, dependee)] = g['graph'].get_bindings(dependant, dependee)
+        return (edge_bindings, g['manifest'])
+
+    with tempfile.TemporaryDirectory() as root:
+        folder = os.path.join(root, 'project')
+        sublime_shim.configure(settings={'excluded_folders': ['node_modules/']}, project_name='roundtrip',
+            folders=[folder], cache_dir=os.path.join(root, 'cache'))
+        os.makedirs(os.path.join(root, 'cache'))
+        package = sublime_shim.load_package()
+        (core, utils) = (package.core, package.utils)
+        modules = synthetic.generate_project(folder, num_files=120, fan_out=4, cycles=3, files_per_dir=20)
+
+        def build():
+            g = {'last_update': None, 'graph': package.dep_graph.DepGraph(), 'index': None}
+            core.build_graph(g, [folder], settings=utils.get_settings('roundtrip'))
+            return g
+
+        g = build()
+        utils.save_graph(g, 'roundtrip')
+
+        # Change imports (with renamed bindings), add and remove files, saving the changes to the journal
+        rnd = random.Random(0)
+        changed = [module['path'] for module in rnd.sample(modules[:-1], 10)]
+        for path in changed:
+            target = os.path.relpath(os.path.splitext(modules[0]['path'])[0], os.path.dirname(path))
+            with open(path, 'r+', encoding='utf8') as f:
+                text = f.read()
+                f.seek(0)
+                f.write("import Renamed, { Module0000 as M } from './%s';\n%s" % (target, text))
+        added = os.path.join(os.path.dirname(modules[0]['path']), 'added.js')
+        with open(added, 'w', encoding='utf8') as f:
+            f.write("const { Module0001: M } = require('./module_0001');\n")
+        removed = modules[-1]['path']
+        os.remove(removed)
+        core.apply_changes(g, 'roundtrip', changed + [added], [removed])
+        assert os.path.getsize(utils.get_dep_journal_path('roundtrip')) > 0
+
+        loaded = utils.load_graph('roundtrip')
+        fresh = build()
+        assert describe(loaded) == describe(g)
+        assert describe(loaded) == describe(fresh)
+        assert loaded['graph'].get_bindings(changed[0], modules[0]['path']) == (('Module0000', 'M'), ('default', 'Renamed'))
+
+        # Files touched without changing them (e.g. a fresh checkout) aren't re-scanned, only their new
+        # mtimes are journaled. A file of the same size with different contents is
+        future = loaded['last_update'] + 1000
+        for path in core.find_files([folder], utils.get_settings('roundtrip'), utils.DirIndex()):
+            os.utime(path, (future, future))
+        with open(changed[1], 'r+b') as f:
+            text = f.read()
+            f.seek(0)
+            f.write(text.replace(b'Module', b'Mxdule', 1))
+        os.utime(changed[1], (future, future))
+        settings = utils.get_settings('roundtrip')
+        (modified, gone, touched) = core.get_changed_files(loaded['manifest'], [folder], settings, utils.DirIndex())
+        assert (modified, gone) == ([changed[1]], [])
+        assert len(touched) == len(loaded['manifest']) - 1 and all(stat[0] == future for stat in touched.values())
+        core.refresh_graph(loaded, [folder], 'roundtrip')
+        reloaded = utils.load_graph('roundtrip')
+        assert describe(reloaded) == describe(loaded)
+        assert core.get_changed_files(reloaded['manifest'], [folder], settings, utils.DirIndex()) == ([], [], {})
+
+        # Following imported names finds every usage the search by name does, default exports
+        # wrapped in an expression included
+        wrapped = os.path.join(folder, 'wrapped.js')
+        with open(wrapped, 'w', encoding='utf8') as f:
+            f.write("class Wrapped {}\nexport default connect(mapState)(Wrapped);\n")
+        with open(os.path.join(folder, 'wrapping_user.js'), 'w', encoding='utf8') as f:
+            f.write("import Wrapped from './wrapped';\nnew Wrapped();\n")
+        core.refresh_graph(reloaded, [folder], 'roundtrip')
+        subjects = [(module['path'], module['name']) for module in modules[:-1]] + [(wrapped, 'Wrapped')]
+        for (path, subject) in subjects:
+            files = reloaded['graph'].get_dependants(path) + [path]
+            names = core.find_visible_names(reloaded, path, subject)
+            found = {(u['path'], u['line_nr']) for u in core.get_usages_in_files(subject, files)}
+            pruned = core.get_usages_in_files(subject, [f for f in files if f in names], names=names)
+            assert found <= {(u['path'], u['line_nr']) for u in pruned}, subject
+        assert len(core.get_usages_in_files('Wrapped', list(names), names=names)) == 2
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+# Rough cost in bytes of a manifest entry: path key and [mtime, size] list
+MANIFEST_ENTRY_BYTES = 300
+
+def graph_size(g):
+    """Estimate the memory held by a project's graph, its manifest and usage index in bytes"""
+    size = g['graph'].memory_size() + len(g.get('manifest') or ()) * MANIFEST_ENTRY_BYTES
+    if g.get('index') is not None:
+        size += g['index'].memory_size()
+    return size
+
+class GraphStore:
+    """
+    The loaded graphs by project name, kept within a memory budget.
+
+    Graphs are ordered by last use. Once the estimated size of all graphs exceeds the
+    budget the least recently used ones are evicted, except for the most recently used
+    graph which is always kept. `on_evict(project_name, g, size)` is called for each evicted
+    graph outside of the store's lock; evicted graphs are loaded from the cache again
+    when next needed.
+
+    Sizes are re-estimated whenever the budget is enforced since graphs grow and shrink
+    as files change.
+    """
+
+    def __init__(self, budget = 0, on_evict = None):
+        self.budget = budget
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+        self.graphs = OrderedDict()
+
+    def __contains__(self, project_name):
+        return project_name in self.graphs
+
+    def get(self, project_name, default = None):
+        """Return the graph of a project and mark it as most recently used"""
+        with self.lock:
+            if project_name not in self.graphs: return default
+            self.graphs.move_to_end(project_name)
+            return self.graphs[project_name]
+
+    def peek(self, project_name, default = None):
+        """Return the graph of a project without counting it as used, e.g. for background refreshes"""
+        return self.graphs.get(project_name, default)
+
+    def set(self, project_name, g):
+        """Add or replace the graph of a project as the most recently used, see `enforce_budget`"""
+        with self.lock:
+            self.graphs[project_name] = g
+            self.graphs.move_to_end(project_name)
+
+    def clear(self):
+        with self.lock:
+            self.graphs.clear()
+
+    def sizes(self):
+        """Return [(project_name, estimated size)] from least to most recently used"""
+        with self.lock:
+            graphs = list(self.graphs.items())
+        return [(project_name, graph_size(g)) for (project_name, g) in graphs]
+
+    def enforce_budget(self, budget = None):
+        """Evict the least recently used graphs while over the budget (no limit if 0)"""
+        if budget is not None: self.budget = budget
+        if not self.budget: return
+        sizes = self.sizes()
+        total = sum(size for (project_name, size) in sizes)
+        evicted = []
+        with self.lock:
+            for (project_name, size) in sizes[:-1]:
+                if total <= self.budget: break
+                g = self.graphs.get(project_name)
+                # Skip graphs used while sizes were estimated
+                if g is None or next(reversed(self.graphs)) == project_name: continue
+                del self.graphs[project_name]
+                evicted.append((project_name, g, size))
+                total -= size
+        for (project_name, g, size) in evicted:
+            if self.on_evict: self.on_evict(project_name, g, size)
@@ -0,0 +1,434 @@
+"""
+Single pass tokenizer for JavaScript/CoffeeScript sources.
+
+Walks through a file once and yields its identifiers with their context: code,
+import, comment or string. Identifiers in code are checked for being a usage
+(rather than a definition, a property or part of an import) with the same rules
+as `core.is_actual_usage`, but for every occurrence on a line.
+
+Like `core.classify_lines`, imports are recognized per line and lines starting
+with `#` or `//` are comments. Block comments may span lines, strings end at the
+end of a line at the latest.
+"""
+import re
+from bisect import bisect_right
+
+CODE = 1
+IMPORT = 2
+COMMENT = 4
+STRING = 8
+
+IGNORED_PREFIX = (
+    'import',
+    'include',
+    'require',
+    'function',
+    'const',
+    'var',
+    'let',
+    'def',
+    'class'
+)
+IGNORED_BEFORE = (
+    'import',
+    'include',
+    'require'
+)
+IGNORED_SUFFIX = (
+    ':',
+    '='
+)
+
+# Characters that may surround a usage (besides whitespace)
+BOUNDARY_BEFORE = frozenset('()[]{},+*/%!;:\'"=<>-')
+BOUNDARY_AFTER = BOUNDARY_BEFORE | frozenset('.')
+# Characters allowed between a definition keyword and the defined name
+DEFINITION_GAP = ' \t ([{}])'
+
+IDENTIFIER_RE = re.compile(r'[A-Za-z_$][\w$]*')
+SPECIAL_RE = re.compile(r'["\'`]|//|/\*')
+STRING_RES = {
+    '"': re.compile(r'"(?:[^"\\]|\\.)*"?'),
+    "'": re.compile(r"'(?:[^'\\]|\\.)*'?"),
+    '`': re.compile(r'`(?:[^`\\]|\\.)*`?')
+}
+SINGLE_LINE_IMPORT_RE = re.compile(r'\b(import|require|include)[^\[:.].*[\'\"][^\'\"]+[\'\"].*$')
+MULTI_LINE_IMPORT_START_RE = re.compile(r'\b(import|require|include)\b[\s()\[\]{}]*$')
+MULTI_LINE_IMPORT_END_RE = re.compile(r'^[)}\]](\s*from.+)?$')
+IMPORT_PATH_RE = re.compile(r'[\'\"]([^\'\"]+)[\'\"]')
+
+# Import statements whose bindings are understood, see `parse_bindings`
+ES_IMPORT_RE = re.compile(r'^import\s+(?:type\s+)?(.+?)\s*from\s*[\'"][^\'"]+[\'"]\s*;?$', re.DOTALL)
+SIDE_EFFECT_IMPORT_RE = re.compile(r'^(?:import|require)\s*\(?\s*[\'"][^\'"]+[\'"]\s*\)?\s*;?$')
+REQUIRE_RE = re.compile(r'^(?:(?:const|let|var)\s+)?(\{[^{}]*\}|[A-Za-z_$][\w$]*)\s*=\s*'
+    r'require\s*\(?\s*[\'"][^\'"]+[\'"]\s*\)?(?:\.([A-Za-z_$][\w$]*))?\s*;?$', re.DOTALL)
+ES_ALIAS_RE = re.compile(r'\s+as\s+')
+DESTRUCTURING_ALIAS_RE = re.compile(r'\s*:\s*')
+NAMESPACE_RE = re.compile(r'^\*\s*as\s+([A-Za-z_$][\w$]*)$')
+DEFAULT_EXPORT_RE = re.compile(r'\bexport\s+default\b|\bmodule\.exports\s*=(?!=)|\bexport\s*\{[^}]*?([A-Za-z_$][\w$]*)\s+as\s+default\b')
+# What follows `export default` or `module.exports =` when a name is exported: a named class or
+# function declaration, or a name that's the whole statement (not `connect(mapState)(Foo)`)
+EXPORTED_NAME_RE = re.compile(r'[ \t]*(?:(?:(?:abstract\s+)?class\s+|(?:async\s+)?function\b\s*\*?\s*)([A-Za-z_$][\w$]*)'
+    r'|(?!(?:class|function|async|new|require)\b)([A-Za-z_$][\w$]*)[ \t]*(?:;|$))', re.MULTILINE)
+
+def is_usage(line, start, end, import_end):
+    """
+    Return True if the identifier at line[start:end] is a usage.
+    `import_end` is the end of the first import keyword on the line (see `find_import_end`).
+    """
+    if start:
+        char = line[start - 1]
+        if char not in BOUNDARY_BEFORE and not char.isspace(): return False
+        before_end = start
+        while before_end and line[before_end - 1] in DEFINITION_GAP:
+            before_end -= 1
+        if line.endswith(IGNORED_PREFIX, 0, before_end): return False
+        if import_end <= before_end: return False
+    if end < len(line):
+        char = line[end]
+        if char not in BOUNDARY_AFTER and not char.isspace(): return False
+        while end < len(line) and line[end] in ' \t ':
+            end += 1
+        if line.startswith(IGNORED_SUFFIX, end): return False
+    return True
+
+def find_import_end(line):
+    "Return the end of the first `import`, `include` or `require` in `line` (past the end if none)"
+    import_end = len(line) + 1
+    for keyword in IGNORED_BEFORE:
+        pos = line.find(keyword)
+        if pos != -1: import_end = min(import_end, pos + len(keyword))
+    return import_end
+
+def is_import_line(stripped, in_import):
+    "Return (is_import, in_import) for a line stripped of whitespace and semicolons"
+    if in_import:
+        return (True, not MULTI_LINE_IMPORT_END_RE.search(stripped))
+    if 'import' not in stripped and 'require' not in stripped and 'include' not in stripped:
+        return (False, False)
+    if SINGLE_LINE_IMPORT_RE.search(stripped):
+        return (True, False)
+    if MULTI_LINE_IMPORT_START_RE.search(stripped):
+        return (True, True)
+    return (False, False)
+
+def is_name(text):
+    match = IDENTIFIER_RE.match(text)
+    return bool(match) and match.end() == len(text)
+
+def parse_bindings(statement):
+    """
+    Return the names bound by an import statement as (imported name, local name) pairs,
+    'default' being the default export (or the whole module for a `require`) and '*' all of
+    its exports. Returns None if the statement isn't understood.
+
+    >>> parse_bindings("import Foo, { bar as baz } from './foo'")
+    [('bar', 'baz'), ('default', 'Foo')]
+    >>> parse_bindings("const { bar, qux: quux } = require('./foo')")
+    [('bar', 'bar'), ('qux', 'quux')]
+    >>> parse_bindings("Foo = require './foo'")
+    [('default', 'Foo')]
+    >>> parse_bindings("import { classNames as cx } from 'classnames'")
+    [('classNames', 'cx')]
+    >>> parse_bindings("import './polyfills'")
+    []
+    """
+    statement = statement.strip().rstrip(';').strip()
+    if SIDE_EFFECT_IMPORT_RE.match(statement): return []
+    match = ES_IMPORT_RE.match(statement)
+    if match:
+        return parse_bindings_clause(match.group(1), ES_ALIAS_RE)
+    match = REQUIRE_RE.match(statement)
+    if match:
+        (target, member) = match.groups()
+        if target[0] == '{':
+            return None if member else parse_bindings_clause(target, DESTRUCTURING_ALIAS_RE)
+        return [(member or 'default', target)]
+    return None
+
+def parse_bindings_clause(clause, alias_re):
+    "Parse `Foo, { bar, baz as qux }` (or a destructuring pattern), see `parse_bindings`"
+    bindings = []
+    braces = re.search(r'\{([^{}]*)\}', clause)
+    if braces:
+        for item in braces.group(1).split(','):
+            item = ' '.join(item.split())
+            if item.startswith('type '): item = item[5:]
+            if not item: continue
+            (imported, local) = (alias_re.split(item) + [item])[:2]
+            if not is_name(imported) or not is_name(local): return None
+            bindings.append((imported, local))
+        clause = clause[:braces.start()] + clause[braces.end():]
+    for item in clause.split(','):
+        item = item.strip()
+        if not item: continue
+        namespace = NAMESPACE_RE.match(item)
+        if namespace:
+            bindings.append(('*', namespace.group(1)))
+        elif is_name(item):
+            bindings.append(('default', item))
+        else:
+            return None
+    return bindings
+
+def find_default_exports(code):
+    """
+    Return the names a file exports as its default export (`export default Foo`,
+    `module.exports = Foo`, ...). None if it exports something without a name of its own
+    or an expression (`export default connect(mapState)(Foo)`, `module.exports = new Foo`).
+
+    >>> sorted(find_default_exports('export default Foo;'))
+    ['Foo']
+    >>> sorted(find_default_exports('module.exports = class Foo extends Bar'))
+    ['Foo']
+    >>> find_default_exports('export default connect(mapState)(Foo)') is None
+    True
+    >>> find_default_exports('export default React.memo(Bar);') is None
+    True
+    """
+    names = set()
+    for match in DEFAULT_EXPORT_RE.finditer(code):
+        if match.group(1):
+            names.add(match.group(1))
+            continue
+        exported = EXPORTED_NAME_RE.match(code, match.end())
+        if not exported: return None
+        names.add(exported.group(1) or exported.group(2))
+    return names
+
+def segments(text, contexts = CODE, imports = None, statements = None):
+    """
+    Generator splitting `text` into segments of a single context in one pass.
+    Yields (context, line_nr, line_start, line, start, end) for the segments line[start:end]
+    whose context is in the `contexts` bitmask.
+    The paths imported by the file are appended to the `imports` list if one is passed,
+    and the text of their import statements to `statements`.
+    """
+    in_comment = False
+    in_import = False
+    statement = []
+    line_start = 0
+    for (line_nr, line) in enumerate(text.split('\n'), 1):
+        pos = 0
+        end = len(line)
+
+        if in_comment:
+            comment_end = line.find('*/')
+            pos = end if comment_end == -1 else comment_end + 2
+            if contexts & COMMENT:
+                yield (COMMENT, line_nr, line_start, line, 0, pos)
+            in_comment = comment_end == -1
+        else:
+            stripped = line.strip('\t ;')
+            if stripped.startswith(('#', '//')):
+                pos = end
+                if contexts & COMMENT:
+                    yield (COMMENT, line_nr, line_start, line, 0, end)
+            else:
+                (is_import, in_import) = is_import_line(stripped, in_import)
+                if is_import:
+                    pos = end
+                    if imports is not None:
+                        statement.append(line)
+                        paths = IMPORT_PATH_RE.findall(line)
+                        if paths:
+                            imports.append(paths[-1])
+                            if statements is not None: statements.append('\n'.join(statement))
+                            statement = []
+                    if contexts & IMPORT:
+                        yield (IMPORT, line_nr, line_start, line, 0, end)
+                else:
+                    statement = []
+
+        if pos < end and not SPECIAL_RE.search(line, pos):
+            # Plain code till the end of the line
+            if contexts & CODE:
+                yield (CODE, line_nr, line_start, line, pos, end)
+            pos = end
+
+        while pos < end:
+            match = SPECIAL_RE.search(line, pos)
+            code_end = match.start() if match else end
+            if code_end > pos and contexts & CODE:
+                yield (CODE, line_nr, line_start, line, pos, code_end)
+            if not match: break
+            delimiter = match.group()
+            if delimiter == '/*':
+                comment_end = line.find('*/', match.end())
+                in_comment = comment_end == -1
+                (context, pos) = (COMMENT, end if in_comment else comment_end + 2)
+            elif delimiter == '//':
+                (context, pos) = (COMMENT, end)
+            else:
+                (context, pos) = (STRING, STRING_RES[delimiter].match(line, code_end).end())
+            if contexts & context:
+                yield (context, line_nr, line_start, line, code_end, pos)
+
+        line_start += len(line) + 1
+
+def find_usages(parsed, subject):
+    """
+    Return the usages of the identifier `subject` in a `scan`ned file as (line_nr, offset) pairs.
+    Searches the joined code of the file so only actual occurrences are checked one by one.
+    """
+    usages = []
+    (code_segments, code, starts) = (parsed['segments'], parsed['code'], parsed['starts'])
+    pos = code.find(subject)
+    while pos != -1:
+        i = bisect_right(starts, pos) - 1
+        (context, line_nr, line_start, line, start, end) = code_segments[i]
+        line_pos = start + pos - starts[i]
+        if is_usage(line, line_pos, line_pos + len(subject), find_import_end(line)):
+            usages.append((line_nr, line_start + line_pos))
+        pos = code.find(subject, pos + len(subject))
+    return usages
+
+def trie_pattern(words):
+    """
+    Return a regex pattern matching any of `words`, shaped like a trie so that
+    common prefixes are matched once instead of trying each word in turn.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def to_pattern(node):
+        is_end = '' in node
+        branches = [re.escape(char) + to_pattern(child) for (char, child) in sorted(node.items()) if char]
+        if not branches: return ''
+        if len(branches) == 1 and not is_end: return branches[0]
+        return '(?:%s)%s' % ('|'.join(branches), '?' if is_end else '')
+
+    return to_pattern(trie)
+
+def compile_subjects(subjects):
+    "Compile a pattern for `find_usages_of` matching any of the identifiers in `subjects`"
+    return re.compile(r'(?<![\w$])(?:%s)(?![\w$])' % trie_pattern(subjects))
+
+def find_usages_of(parsed, subjects_re):
+    """
+    Return the usages of several identifiers in a `scan`ned file in one pass over its code.
+    `subjects_re` comes from `compile_subjects`. Returns {identifier: [(line_nr, offset), ...]}.
+    """
+    usages = {}
+    (code_segments, starts) = (parsed['segments'], parsed['starts'])
+    for match in subjects_re.finditer(parsed['code']):
+        pos = match.start()
+        i = bisect_right(starts, pos) - 1
+        (context, line_nr, line_start, line, start, end) = code_segments[i]
+        line_pos = start + pos - starts[i]
+        if not is_usage(line, line_pos, line_pos + match.end() - pos, find_import_end(line)): continue
+        subject = match.group()
+        if subject not in usages: usages[subject] = []
+        usages[subject].append((line_nr, line_start + line_pos))
+    return usages
+
+def find_all_usages(code_segments):
+    """
+    Find the usages of all identifiers in CODE segments at once.
+    Returns {identifier: [[line_nr, offset], ...]}.
+
+    Same as checking every identifier in code with `is_usage` but with the check inlined: the
+    definition check looks at the previous identifier instead of the text before the match.
+    """
+    postings = {}
+    for (context, line_nr, line_start, line, start, end) in code_segments:
+        import_end = find_import_end(line)
+        line_end = len(line)
+        previous = None
+        for match in IDENTIFIER_RE.finditer(line, start, end):
+            (name_start, name_end) = match.span()
+            name = match.group()
+            (before, previous) = (previous, (name, name_end))
+            if name_start:
+                char = line[name_start - 1]
+                if char not in BOUNDARY_BEFORE and not char.isspace(): continue
+                if before and before[0].endswith(IGNORED_PREFIX) and not line[before[1]:name_start].strip(DEFINITION_GAP): continue
+                if import_end <= name_start and not is_usage(line, name_start, name_end, import_end): continue
+            if name_end < line_end:
+                char = line[name_end]
+                if char not in BOUNDARY_AFTER and not char.isspace(): continue
+                if line.startswith(IGNORED_SUFFIX, name_end) or \
+                    (char in ' \t' and line[name_end:].lstrip(' \t ').startswith(IGNORED_SUFFIX)): continue
+            if name in postings:
+                postings[name].append([line_nr, line_start + name_start])
+            else:
+                postings[name] = [[line_nr, line_start + name_start]]
+    return postings
+
+def scan(text):
+    """
+    Split `text` into its code segments and imports in one pass.
+    Returns {'segments', 'code', 'starts', 'imports', 'bindings'}: the CODE segments, their text
+    joined by newlines, the offset of each segment in the joined text, the imported paths and
+    the names bound by each import (see `parse_bindings`).
+    """
+    imports = []
+    statements = []
+    code_segments = list(segments(text, CODE, imports, statements))
+    starts = []
+    offset = 0
+    for (context, line_nr, line_start, line, start, end) in code_segments:
+        starts.append(offset)
+        offset += end - start + 1
+    code = '\n'.join([line[start:end] for (context, line_nr, line_start, line, start, end) in code_segments])
+    bindings = [parse_bindings(statement) for statement in statements]
+    return {'segments': code_segments, 'code': code, 'starts': starts, 'imports': imports, 'bindings': bindings}
+
+if __name__ == "__main__":
+
+    # Test: the usages found by the lexer match the line based finders of `core` it replaced.
+    # Those only look at the first occurrence on a line, so only lines with a single one are
+    # compared. Run from the repository root: python lexer.py
+
+    import doctest
+    import os
+    import random
+    import tempfile
+    from tools import sublime_shim, synthetic
+
+    doctest.testmod()
+    core = sublime_shim.load_package().core
+
+    samples = [
+        "import Foo from './foo';\n"
+        "import { Bar, Baz as Qux } from './bar';\n"
+        "const helper = require('./helper');\n"
+        "/* Foo in a\n"
+        "   block comment Bar */\n"
+        "// Foo in a line comment\n"
+        "class Widget extends Foo {\n"
+        "  render() { return new Bar(helper(Qux)) }\n"
+        "}\n"
+        "function make(Foo) { return \"Foo\" + 'Bar' + `${Foo}` }\n"
+        "var x = Foo.create(), y = { key: Bar };\n"
+        "export default Widget;\n",
+        "Foo = require './foo'\n"
+        "{ Bar } = require './bar'\n"
+        "# Foo comment\n"
+        "class Widget extends Foo\n"
+        "  render: -> new Bar Foo\n"
+        "  name: \"Foo #{Bar}\"\n"
+        "module.exports = Widget\n"
+    ]
+    rnd = random.Random(0)
+    for i in range(30):
+        render = synthetic.coffee_module if i % 3 == 0 else synthetic.js_module
+        samples.append(render(i + 50, [(j, './m%d' % j) for j in rnd.sample(range(50), 4)], 0.3, 30, rnd))
+
+    with tempfile.TemporaryDirectory() as folder:
+        for (n, text) in enumerate(samples):
+            path = os.path.join(folder, 'sample%d.js' % n)
+            with open(path, 'w', encoding='utf8') as f:
+                f.write(text)
+            lines = text.split('\n')
+            for subject in set(IDENTIFIER_RE.findall(text)):
+                single = lambda usage: lines[usage[0] - 1].count(subject) == 1
+                old = [(usage['line_nr'], usage['region'].a) for usage in core.get_usages_in_lines(path, subject)]
+                new = [(usage['line_nr'], usage['region'].a) for usage in core.get_usages_in_file(path, subject)]
+                assert list(filter(single, old)) == list(filter(single, new)), (n, subject)
+                pairs = find_all_usages(scan(text)['segments']).get(subject, [])
+                assert [tuple(pair) for pair in pairs] == new, (n, subject)
@@ -0,0 +1,256 @@
+"""
+Outline of the class/function/var definitions in a buffer.
+
+Built once per buffer from its text and then kept up to date with the changes made
+to it, so that finding the definition around the cursor is a bisect instead of a
+regex search through the whole buffer. Edits are only recorded as they're made and
+applied when the outline is next used. Positions are character offsets like the
+points of a view.
+"""
+import re
+import threading
+try:
+    import sublime
+except ImportError: # Outside of Sublime Text, e.g. running the tests below
+    sublime = None
+from bisect import bisect_left
+
+CLASS_REGEX = {
+    'regex': r'class ([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+)',
+    'group': [1]
+}
+FUNCTION_REGEX = {
+    'regex': r'(function\s+([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+).+{$)|(def\s([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+).+:$)',
+    'group': [2, 4]
+}
+VAR_REGEX = {
+    'regex': r'(var|let|const)\s+([^\s\(\)\[\]\{\}+*/&\|=<>,:;~-]+)\s*=',
+    'group': [2]
+}
+
+# In order of precedence when looking for the subject of a search
+KINDS = [('class', CLASS_REGEX), ('function', FUNCTION_REGEX), ('var', VAR_REGEX)]
+(CLASS, FUNCTION, VAR) = range(len(KINDS))
+# Like `view.find_all`, `$` matches at the end of each line
+KIND_RES = [re.compile(regex['regex'], re.MULTILINE) for (kind, regex) in KINDS]
+
+# Non-blank lines around a change that are scanned again: a definition spans at most three
+# (`var`, the name and `=` on lines of their own)
+MARGIN_LINES = 2
+
+# Edits recorded for an outline before it's next used. Past this many it's built again instead
+MAX_PENDING_CHANGES = 1000
+
+def get_name(match, regex):
+    return [match.group(i) for i in regex['group'] if match.group(i)][0]
+
+def scan(text, offset = 0):
+    """Return the (start, end, name) definitions in `text` for each kind, offset by `offset`"""
+    definitions = []
+    for (kind_re, (kind, regex)) in zip(KIND_RES, KINDS):
+        definitions.append([(offset + match.start(), offset + match.end(), get_name(match, regex))
+            for match in kind_re.finditer(text)])
+    return definitions
+
+class Outline:
+    """
+    The definitions of a buffer per kind as (start, end, name), sorted by position.
+    `change_count` is the change count of the buffer the outline is up to date with,
+    `pending` the changes made since, up to change count `pending_count`.
+    """
+
+    def __init__(self, text, change_count):
+        self.definitions = scan(text)
+        self.change_count = change_count
+        self.pending = []
+        self.pending_count = change_count
+        self.ends = None
+
+    def find_upwards(self, kind, pos):
+        """
+        Return the name of the last definition of a kind ending before `pos`, or the first one
+        if there are none before it (None if there are none at all).
+        """
+        definitions = self.definitions[kind]
+        if not definitions: return None
+        if self.ends is None:
+            self.ends = [[end for (start, end, name) in kind_definitions] for kind_definitions in self.definitions]
+        i = bisect_left(self.ends[kind], pos) - 1
+        return definitions[max(i, 0)][2]
+
+    def get_definitions(self):
+        """Return all definitions as (start, end, name, kind name) in order of appearance"""
+        definitions = [(start, end, name, KINDS[kind][0])
+            for (kind, kind_definitions) in enumerate(self.definitions) for (start, end, name) in kind_definitions]
+        return sorted(definitions)
+
+    def update(self, changes, text, change_count):
+        """
+        Apply `changes`, a list of (start, end, inserted length) replacements in the order they
+        were made, and scan the changed lines of `text` (the buffer after all changes) again.
+        """
+        dirty = []
+        for (start, end, length) in changes:
+            delta = length - (end - start)
+            # Definitions touching the change are scanned again, the ones after it move along
+            for (kind, kind_definitions) in enumerate(self.definitions):
+                self.definitions[kind] = [
+                    (d_start + delta, d_end + delta, name) if d_start > end else (d_start, d_end, name)
+                    for (d_start, d_end, name) in kind_definitions if d_end < start or d_start > end]
+            moved = [(start, start + length)]
+            for (d_start, d_end) in dirty:
+                if d_start > end:
+                    moved.append((d_start + delta, d_end + delta))
+                elif d_end < start:
+                    moved.append((d_start, d_end))
+                else:
+                    moved.append((min(d_start, start), start + length + max(0, d_end - end)))
+            dirty = moved
+
+        for (start, end) in dirty:
+            self.rescan(start, end, text)
+        self.change_count = change_count
+        self.pending = []
+        self.pending_count = change_count
+        self.ends = None
+
+    def rescan(self, start, end, text):
+        """
+        Scan the lines around [start, end) of `text` again, replacing the definitions overlapping them.
+        """
+        while True:
+            # Extend to whole lines and the margin around them. Definitions only span lines by
+            # whitespace, so blank lines don't count towards the margin
+            start = text.rfind('\n', 0, start) + 1
+            for i in range(MARGIN_LINES):
+                while start > 0:
+                    line_start = text.rfind('\n', 0, start - 1) + 1
+                    is_blank = not text[line_start:start].strip()
+                    start = line_start
+                    if not is_blank: break
+            end = text.find('\n', end)
+            end = len(text) if end == -1 else end
+            for i in range(MARGIN_LINES):
+                while end < len(text):
+                    line_end = text.find('\n', end + 1)
+                    line_end = len(text) if line_end == -1 else line_end
+                    is_blank = not text[end:line_end].strip()
+                    end = line_end
+                    if not is_blank: break
+            # Definitions sticking out of the range are scanned again as a whole
+            (new_start, new_end) = (start, end)
+            for kind_definitions in self.definitions:
+                for (d_start, d_end, name) in kind_definitions:
+                    if d_start <= end and d_end >= start:
+                        (new_start, new_end) = (min(new_start, d_start), max(new_end, d_end))
+            if (new_start, new_end) == (start, end): break
+            (start, end) = (new_start, new_end)
+
+        found = scan(text[start:end], start)
+        for (kind, kind_definitions) in enumerate(self.definitions):
+            before = kind_definitions[:bisect_left(kind_definitions, (start,))]
+            after = kind_definitions[bisect_left(kind_definitions, (end + 1,)):]
+            self.definitions[kind] = before + found[kind] + after
+
+outlines = {}
+lock = threading.Lock()
+
+def get_outline(view):
+    """
+    Return the outline of the buffer of `view`, brought up to date with the changes recorded
+    for it or (re)built if they don't add up to the buffer's current change count
+    """
+    buffer_id = view.buffer_id()
+    change_count = view.change_count()
+    with lock:
+        outline = outlines.get(buffer_id)
+        if outline and outline.change_count == change_count:
+            return outline
+    text = view.substr(sublime.Region(0, view.size()))
+    with lock:
+        if outline and outline.pending_count == change_count and outlines.get(buffer_id) is outline:
+            outline.update(outline.pending, text, change_count)
+        else:
+            outline = Outline(text, change_count)
+            outlines[buffer_id] = outline
+    return outline
+
+def on_text_changed(view, changes):
+    """
+    Record the `changes` made to a buffer for its outline (if it has one), which are applied
+    when it's next used. Doesn't read the buffer, it's called on every edit.
+    """
+    buffer_id = view.buffer_id()
+    with lock:
+        outline = outlines.get(buffer_id)
+        if not outline: return
+        if len(outline.pending) + len(changes) > MAX_PENDING_CHANGES:
+            del outlines[buffer_id]
+            return
+        outline.pending.extend(changes)
+        outline.pending_count = view.change_count()
+
+def forget(buffer_id):
+    with lock:
+        outlines.pop(buffer_id, None)
+
+if __name__ == "__main__":
+
+    # Test: an outline kept up to date through random edits equals scanning the edited text
+    # from scratch. Run from the repository root: python outline.py
+
+    import random
+
+    class FakeView:
+        def __init__(self, text):
+            self.text = text
+            self.count = 0
+
+        def buffer_id(self):
+            return 1
+
+        def change_count(self):
+            return self.count
+
+        def size(self):
+            return len(self.text)
+
+        def substr(self, region):
+            return self.text[region[0]:region[1]]
+
+    sublime = type('sublime', (), {'Region': staticmethod(lambda a, b: (a, b))})
+
+    pieces = ['class Foo extends Bar\n', '  function baz(a, b) {\n', '}\n', 'var x = 1\n', 'const Y= 2\n',
+        'let\n  z = 3\n', 'def q(a):\n', '\n', '  foo(1)\n', 'class ', 'function ', '= ', '{', '\n', 'var ', 'abc', '(x)', '  ']
+    for seed in range(3000):
+        rnd = random.Random(seed)
+        view = FakeView(''.join(rnd.choice(pieces) for i in range(rnd.randint(0, 40))))
+        forget(view.buffer_id())
+        get_outline(view)
+        for step in range(10):
+            # Batches of edits, sometimes several batches before the outline is used again
+            for batch in range(rnd.randint(1, 3)):
+                changes = []
+                for i in range(rnd.randint(1, 3)):
+                    start = rnd.randint(0, len(view.text))
+                    end = min(len(view.text), start + rnd.randint(0, 15))
+                    inserted = ''.join(rnd.choice(pieces) for i in range(rnd.randint(0, 2)))
+                    if rnd.random() < 0.3: inserted = inserted[:rnd.randint(0, len(inserted))]
+                    view.text = view.text[:start] + inserted + view.text[end:]
+                    changes.append((start, end, len(inserted)))
+                view.count += 1
+                on_text_changed(view, changes)
+            assert get_outline(view).definitions == scan(view.text), seed
+
+    # Outlines with too many edits recorded are built again, edits missed are noticed
+    view = FakeView('var a = 1\n')
+    forget(view.buffer_id())
+    first = get_outline(view)
+    for i in range(MAX_PENDING_CHANGES + 1):
+        view.text = 'class B\n' + view.text
+        view.count += 1
+        on_text_changed(view, [(0, 0, len('class B\n'))])
+    assert get_outline(view) is not first and get_outline(view).definitions == scan(view.text)
+    view.text = 'const c = 2\n'
+    view.count += 1
+    assert get_outline(view).definitions == scan(view.text)
@@ -0,0 +1,176 @@
+"""
+Lightweight instrumentation: timed phases and counters.
+
+Disabled by default (see the `collect_stats` setting). While disabled `span()`
+returns a shared no-op context manager and `count()` returns right away, so the
+calls can stay in place. Hot paths check `stats.enabled` themselves.
+
+Phases and counters add up to totals since stats were enabled. `operation()`
+records the change of the totals during a lookup or rebuild in a ring buffer of
+the last `stats_history` operations. Work of concurrently running operations
+(e.g. a lookup during a background refresh) shows up in both of them.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+enabled = False
+lock = threading.Lock()
+counters = {}
+timings = {} # phase: [calls, seconds]
+history = deque(maxlen=50)
+
+def configure(is_enabled, history_size = 50):
+    global enabled, history
+    if history_size != history.maxlen:
+        history = deque(history, maxlen=max(history_size, 1))
+    if is_enabled and not enabled: reset()
+    enabled = bool(is_enabled)
+
+def reset():
+    with lock:
+        counters.clear()
+        timings.clear()
+        history.clear()
+
+def count(name, n = 1):
+    if not enabled: return
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+def add_time(name, seconds, calls = 1):
+    with lock:
+        timing = timings.get(name)
+        if timing is None:
+            timing = timings[name] = [0, 0.0]
+        timing[0] += calls
+        timing[1] += seconds
+
+class Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_time(self.name, time.perf_counter() - self.start)
+
+class NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+null_span = NullSpan()
+
+def span(name):
+    "Context manager timing a phase"
+    return Span(name) if enabled else null_span
+
+def timed(name, fn):
+    "Wrap `fn` so its calls are timed as the phase `name`. Only use when `enabled`"
+    def timed_fn(*args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            add_time(name, time.perf_counter() - start)
+    return timed_fn
+
+def get_totals():
+    with lock:
+        return (dict(counters), {name: list(timing) for (name, timing) in timings.items()})
+
+class Operation:
+    """A lookup or rebuild, started when created and recorded in the history by `finish()`"""
+
+    def __init__(self, kind, label):
+        self.kind = kind
+        self.label = label
+        self.time = time.time()
+        self.start = time.perf_counter()
+        (self.counters, self.timings) = get_totals()
+
+    def finish(self, **info):
+        duration = time.perf_counter() - self.start
+        (current_counters, current_timings) = get_totals()
+        record = {
+            'kind': self.kind,
+            'label': self.label,
+            'time': self.time,
+            'duration': duration,
+            'counters': {},
+            'phases': {}
+        }
+        record.update(info)
+        for (name, value) in current_counters.items():
+            if value != self.counters.get(name, 0):
+                record['counters'][name] = value - self.counters.get(name, 0)
+        for (name, (calls, seconds)) in current_timings.items():
+            (start_calls, start_seconds) = self.timings.get(name, (0, 0.0))
+            if calls != start_calls:
+                record['phases'][name] = {'calls': calls - start_calls, 'seconds': seconds - start_seconds}
+        with lock:
+            history.append(record)
+
+class NullOperation:
+
+    def finish(self, **info):
+        pass
+
+null_operation = NullOperation()
+
+def operation(kind, label = ''):
+    return Operation(kind, label) if enabled else null_operation
+
+def get_data():
+    "Return all collected stats as a JSON serializable dict"
+    (current_counters, current_timings) = get_totals()
+    with lock:
+        operations = list(history)
+    return {
+        'enabled': enabled,
+        'counters': current_counters,
+        'phases': {name: {'calls': calls, 'seconds': seconds} for (name, (calls, seconds)) in current_timings.items()},
+        'operations': operations
+    }
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(get_data(), f, indent=2, sort_keys=True)
+
+def format_phases(phases, indent = '  '):
+    lines = []
+    for (name, phase) in sorted(phases.items(), key=lambda item: -item[1]['seconds']):
+        lines.append('%s%-20s %8d calls %10.1f ms' % (indent, name, phase['calls'], phase['seconds'] * 1000))
+    return lines
+
+def format_counters(values, indent = '  '):
+    return ['%s%-20s %10d' % (indent, name, value) for (name, value) in sorted(values.items())]
+
+def format_report():
+    "Return the collected stats as human readable text"
+    data = get_data()
+    if not data['enabled'] and not data['operations']:
+        return 'GotoUsage performance stats are disabled. Set "collect_stats": true in the settings to collect them.\n'
+
+    lines = ['GotoUsage performance stats', '']
+    lines.append('Totals')
+    lines.extend(format_phases(data['phases']))
+    lines.extend(format_counters(data['counters']))
+    lines.append('')
+    lines.append('Last %d operations (most recent first)' % len(data['operations']))
+    for record in reversed(data['operations']):
+        lines.append('')
+        lines.append('%s %s %s: %.1f ms' % (time.strftime('%H:%M:%S', time.localtime(record['time'])),
+            record['kind'], record['label'], record['duration'] * 1000))
+        lines.extend(format_phases(record['phases'], '    '))
+        lines.extend(format_counters(record['counters'], '    '))
+    return '\n'.join(lines) + '\n'
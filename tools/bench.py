@@ -0,0 +1,241 @@
+"""
+Benchmark the package outside of Sublime Text on a synthetic project.
+
+    python -m tools.bench --files 2000 --fan-out 5 --output results.json
+    python -m tools.bench --compare results.json
+
+Run from the repository root. Each benchmark reports the best wall time of
+`--repeat` runs, its throughput and (unless --no-memory) the peak memory
+allocated during a separate traced run. Results are printed as a table and
+optionally written as JSON. With --compare, benchmarks that got slower than
+the given results by more than --tolerance make the script exit non-zero.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import sublime_shim
+from . import synthetic
+
+def measure(fn, repeat, memory, setup = None):
+    """Return (best seconds, peak bytes or None) of calling `fn`"""
+    best = None
+    for i in range(repeat):
+        if setup: setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        if setup: setup()
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return (best, peak)
+
+def run_benchmarks(package, modules, folder, args):
+    core = package.core
+    utils = package.utils
+    dep_graph = package.dep_graph
+    settings = utils.get_settings()
+    rnd = random.Random(args.seed)
+
+    def reset_caches():
+        core.parse_cache = None
+        core.result_cache = None
+        utils.shared_dir_index.clear()
+
+    texts = []
+    for module in modules:
+        with open(module['path'], 'r', encoding='utf8') as f:
+            texts.append(f.read())
+    file_lines = [text.splitlines(True) for text in texts]
+    num_lines = sum(len(lines) for lines in file_lines)
+    num_bytes = sum(len(text.encode('utf8')) for text in texts)
+
+    code_lines = [line for lines in file_lines for (start, nr, line) in core.parse_lines(lines, core.C_CODE)]
+    candidates = []
+    for line in code_lines:
+        for name in core.IDENTIFIER_RE.findall(line):
+            if name.startswith('Module'): candidates.append((line, name))
+    imports = []
+    for (module, text) in zip(modules, texts):
+        deps = package.lexer.scan(text)['imports']
+        imports.append((utils.expand_aliases(deps, settings), os.path.dirname(module['path'])))
+    num_imports = sum(len(deps) for (deps, from_path) in imports)
+
+    results = {}
+
+    def bench(name, fn, ops, unit, setup = None):
+        (seconds, peak) = measure(fn, args.repeat, not args.no_memory, setup)
+        results[name] = {
+            'seconds': seconds,
+            'ops': ops,
+            'unit': unit,
+            'ops_per_second': ops / seconds if seconds else None,
+            'peak_memory_bytes': peak
+        }
+        print('%-24s %10.4fs %14.0f %s/s%s' % (name, seconds, results[name]['ops_per_second'] or 0, unit,
+            '' if peak is None else '  peak %8.1f KiB' % (peak / 1024)))
+
+    def parse_all():
+        for lines in file_lines:
+            for line in core.parse_lines(lines, core.C_CODE): pass
+    bench('parse_lines', parse_all, num_lines, 'lines')
+
+    def scan_all():
+        for text in texts: package.lexer.scan(text)
+    bench('lexer_scan', scan_all, num_lines, 'lines')
+
+    scanned = [package.lexer.scan(text) for text in texts]
+    def find_all():
+        for parsed in scanned: package.lexer.find_all_usages(parsed['segments'])
+    bench('find_all_usages', find_all, num_lines, 'lines')
+
+    def check_all():
+        for (line, name) in candidates: core.is_actual_usage(line, name)
+    bench('is_actual_usage', check_all, len(candidates), 'calls')
+
+    def find_all_strings():
+        for line in code_lines: utils.find_strings(line)
+    bench('find_strings', find_all_strings, len(code_lines), 'lines')
+
+    def resolve_all():
+        dir_index = utils.DirIndex()
+        for (deps, from_path) in imports:
+            utils.resolve_dep_paths(deps, from_path, settings.file_filter, settings.folder_filter, settings, dir_index)
+    bench('resolve_dep_paths', resolve_all, num_imports, 'imports')
+
+    g = {}
+    def build():
+        g.clear()
+        g.update({'last_update': None, 'graph': dep_graph.DepGraph(), 'index': None})
+        core.build_graph(g, [folder], settings=settings)
+    bench('build_graph', build, len(modules), 'files', reset_caches)
+    results['build_graph']['bytes_per_second'] = num_bytes / results['build_graph']['seconds']
+
+    g_indexed = {}
+    def build_indexed():
+        g_indexed.clear()
+        g_indexed.update({'last_update': None, 'graph': dep_graph.DepGraph(), 'index': core.UsageIndex()})
+        core.build_graph(g_indexed, [folder], settings=settings)
+    bench('build_graph_indexed', build_indexed, len(modules), 'files', reset_caches)
+
+    graph = g['graph']
+    def traverse_all():
+        for module in modules: graph.get_dependants(module['path'])
+    bench('traverse_graph', traverse_all, len(modules), 'lookups')
+
+    lookups = rnd.sample(modules, min(args.lookups, len(modules)))
+    def lookup_all(**kwargs):
+        for module in lookups:
+            files = graph.get_dependants(module['path'])
+            if module['path'] not in files: files.append(module['path'])
+            core.get_usages_in_files(module['name'], files, **kwargs)
+    bench('lookup_cold', lookup_all, len(lookups), 'lookups', reset_caches)
+    bench('lookup_warm', lookup_all, len(lookups), 'lookups')
+
+    def lookup_batch():
+        files = [module['path'] for module in modules]
+        core.get_usages_of_subjects([module['name'] for module in lookups], files)
+    bench('lookup_batch_cold', lookup_batch, len(lookups), 'subjects', reset_caches)
+
+    index = core.UsageIndex()
+    for module in modules: core.index_file(index, module['path'])
+    bench('lookup_indexed', lambda: lookup_all(index=index), len(lookups), 'lookups', reset_caches)
+    warm_results = lambda: lookup_all(project_name='bench')
+    bench('lookup_result_cache', warm_results, len(lookups), 'lookups', warm_results)
+
+    return {
+        'project': {
+            'files': len(modules),
+            'lines': num_lines,
+            'bytes': num_bytes,
+            'imports': num_imports,
+            'dependencies': graph.num_deps
+        },
+        'results': results
+    }
+
+def compare(current, baseline, tolerance):
+    """Print the change against `baseline` results. Returns the names of benchmarks that regressed"""
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('seconds'): continue
+        ratio = result['seconds'] / base['seconds']
+        print('%-24s %+7.1f%%' % (name, (ratio - 1) * 100))
+        if ratio > 1 + tolerance: regressions.append(name)
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--files', type=int, default=1000, help='number of modules to generate')
+    parser.add_argument('--fan-out', type=int, default=5, help='imports per module')
+    parser.add_argument('--comment-density', type=float, default=0.2, help='share of body lines that are comments')
+    parser.add_argument('--cycles', type=int, default=10, help='number of imports closing an import cycle')
+    parser.add_argument('--coffee-ratio', type=float, default=0.2, help='share of CoffeeScript modules')
+    parser.add_argument('--body-lines', type=int, default=40, help='lines per class body')
+    parser.add_argument('--lookups', type=int, default=20, help='number of end-to-end lookups')
+    parser.add_argument('--workers', type=int, default=4, help='value of the scan_workers setting')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--project', help='generate the project here and keep it (default: a temporary directory)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced runs measuring peak memory')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='compare against results previously written with --output')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    root = args.project or tempfile.mkdtemp(prefix='gotousage-bench-')
+    cache_dir = tempfile.mkdtemp(prefix='gotousage-cache-')
+    sublime_shim.configure(settings={
+        'file_extensions': ['.js', '.coffee', '.jsx'],
+        'excluded_folders': ['node_modules/'],
+        'scan_workers': args.workers
+    }, project_name='bench', folders=[root], cache_dir=cache_dir)
+    package = sublime_shim.load_package()
+    package.utils.clear_settings()
+
+    try:
+        modules = synthetic.generate_project(root, args.files, args.fan_out, args.comment_density, args.cycles,
+            args.coffee_ratio, args.body_lines, seed=args.seed)
+        report = run_benchmarks(package, modules, root, args)
+    finally:
+        if not args.project: shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report['params'] = {k: v for k, v in vars(args).items() if k not in ['output', 'compare', 'project']}
+    report['environment'] = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.time()
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions: %s' % ', '.join(regressions))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
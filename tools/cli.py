@@ -0,0 +1,205 @@
+"""
+Build dependency graphs and query usages from the command line.
+
+    python -m tools.cli build --project my_project --folder ~/code/my_project
+    python -m tools.cli usages MyClass --project my_project --file ~/code/my_project/src/my_class.js
+    python -m tools.cli dependants ~/code/my_project/src/my_class.js --project my_project
+
+Run from the repository root. `build` writes the same cache files the plugin
+loads on startup, so pointing --cache-dir at Sublime Text's cache directory
+(the default) prebuilds the graph and usage index for the editor. The project
+name is the name of the `.sublime-project` file without its extension.
+
+Settings are read from the package's GotoUsage.sublime-settings, overridden by
+the --settings files in order (e.g. the one in Packages/User).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from . import sublime_shim
+
+DEFAULT_SETTINGS_PATH = os.path.join(sublime_shim.PACKAGE_ROOT, 'GotoUsage.sublime-settings')
+
+# Comments and trailing commas are allowed in settings files. Strings are matched to skip them
+SETTINGS_NOISE_RE = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/|,(?=\s*[}\]])', re.DOTALL)
+
+def default_cache_path():
+    "Return the cache directory of Sublime Text on this platform"
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/Sublime Text/Cache')
+    if sys.platform == 'win32':
+        return os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'Sublime Text', 'Cache')
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'sublime-text', 'Cache')
+
+def read_settings_file(path):
+    with open(path, 'r', encoding='utf8') as f:
+        text = f.read()
+    return json.loads(SETTINGS_NOISE_RE.sub(lambda match: match.group(1) or '', text))
+
+def read_settings(paths):
+    "Merge the default settings with the settings files in `paths` like Sublime Text does (per top-level key)"
+    settings = read_settings_file(DEFAULT_SETTINGS_PATH)
+    for path in paths:
+        settings.update(read_settings_file(path))
+    return settings
+
+def parse_path_map(values):
+    path_map = []
+    for value in values:
+        if '=' not in value:
+            raise ValueError("Expected --path-map OLD=NEW, got '%s'" % value)
+        (old, new) = value.split('=', 1)
+        path_map.append((os.path.abspath(old), new))
+    return path_map
+
+def map_path(path, path_map):
+    for (old, new) in path_map:
+        if path == old or path.startswith(old.rstrip(os.sep) + os.sep):
+            return new + path[len(old):]
+    return path
+
+def remap_graph(package, g, path_map):
+    "Return a copy of graph `g` with its paths rewritten according to `path_map`"
+    (nodes, edges) = g['graph'].get_edges()
+    graph = package.dep_graph.DepGraph()
+    graph.set_edges([map_path(node, path_map) for node in nodes], edges)
+    graph.set_edge_bindings(g['graph'].get_edge_bindings())
+    remapped = {
+        'last_update': g['last_update'],
+        'graph': graph,
+        'manifest': {map_path(path, path_map): stat for (path, stat) in g.get('manifest', {}).items()},
+        'index': None
+    }
+    if g.get('index') is not None:
+        data = g['index'].get_data()
+        data['files'] = {map_path(path, path_map): entry for (path, entry) in data['files'].items()}
+        remapped['index'] = package.core.UsageIndex()
+        remapped['index'].set_data(data)
+    return remapped
+
+def load(args):
+    """Configure the stand-in editor from the command line arguments and load the package"""
+    settings = read_settings(args.settings)
+    if args.verbose: settings['verbose_logging'] = True
+    folders = [os.path.abspath(folder) for folder in args.folder]
+    os.makedirs(args.cache_dir, exist_ok=True)
+    sublime_shim.configure(settings=settings, project_name=args.project, folders=folders, cache_dir=args.cache_dir)
+    package = sublime_shim.load_package()
+    package.utils.clear_settings()
+    return (package, folders)
+
+def load_graph(package, project_name, folders):
+    """Load a project's graph and index from cache, bringing them up to date with `folders`"""
+    g = package.utils.load_graph(project_name)
+    if not g: return None
+    g['index'] = None
+    if not package.utils.get_setting('disable_usage_index', False, project_name):
+        g['index'] = package.utils.load_index(project_name) or package.core.UsageIndex()
+    if folders: package.core.refresh_graph(g, folders, project_name)
+    return g
+
+def build(args):
+    (package, folders) = load(args)
+    if not folders:
+        print('At least one --folder is required to build a graph', file=sys.stderr)
+        return 2
+    try:
+        path_map = parse_path_map(args.path_map)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    core = package.core
+    utils = package.utils
+    g = {
+        'last_update': None,
+        'graph': package.dep_graph.DepGraph(),
+        'index': core.create_index(args.project)
+    }
+    start = time.time()
+    core.build_graph(g, folders, settings=utils.get_settings(args.project))
+    if path_map:
+        g = remap_graph(package, g, path_map)
+    utils.save_graph(g, args.project)
+    if g['index'] is not None:
+        utils.save_index(g['index'], args.project)
+    print('Built graph for %s: %d files, %d dependencies in %.1fs' % (
+        args.project, len(g['manifest']), g['graph'].num_deps, time.time() - start))
+    print('Saved to %s' % utils.get_dep_cache_path(args.project))
+    return 0
+
+def usages(args):
+    (package, folders) = load(args)
+    core = package.core
+    utils = package.utils
+    settings = utils.get_settings(args.project)
+
+    if args.file is None or settings.get('disable_dep_graph', False):
+        if not folders:
+            print('Searching without a dependency graph requires --folder', file=sys.stderr)
+            return 2
+        found = core.get_usages_in_folders(args.subject, folders, settings)
+    else:
+        g = load_graph(package, args.project, folders)
+        if not g:
+            print("No cached graph for '%s', run the build command first" % args.project, file=sys.stderr)
+            return 1
+        file_path = os.path.abspath(args.file)
+        files = g['graph'].get_dependants(file_path)
+        if file_path not in files: files.append(file_path)
+        names = None
+        if core.is_identifier(args.subject) and settings.get('follow_imported_names', True):
+            names = core.find_visible_names(g, file_path, args.subject, settings)
+            files = [f for f in files if f in names]
+        found = core.get_usages_in_files(args.subject, files, g.get('index'), names=names)
+        if g.get('index') is not None and g['index'].dirty:
+            utils.save_index_changes(g['index'], args.project)
+
+    for usage in found:
+        print('%s:%d' % (usage['path'], usage['line_nr']))
+    return 0
+
+def dependants(args):
+    (package, folders) = load(args)
+    g = load_graph(package, args.project, folders)
+    if not g:
+        print("No cached graph for '%s', run the build command first" % args.project, file=sys.stderr)
+        return 1
+    for file_path in sorted(g['graph'].get_dependants(os.path.abspath(args.file))):
+        print(file_path)
+    return 0
+
+def main(argv = None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--project', required=True, help='project name (the .sublime-project file name without extension)')
+    common.add_argument('--folder', action='append', default=[], help='project folder, can be repeated')
+    common.add_argument('--settings', action='append', default=[], help='settings file overriding the defaults, can be repeated')
+    common.add_argument('--cache-dir', default=default_cache_path(), help='Sublime Text cache directory (default: %(default)s)')
+    common.add_argument('--verbose', action='store_true', help='enable verbose logging')
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    build_parser = commands.add_parser('build', parents=[common], help='build and cache the dependency graph')
+    build_parser.add_argument('--path-map', action='append', default=[], metavar='OLD=NEW',
+        help='rewrite paths starting with OLD to start with NEW in the cache, e.g. for a different checkout location')
+    build_parser.set_defaults(run=build)
+
+    usages_parser = commands.add_parser('usages', parents=[common], help='find the usages of a class/function/var')
+    usages_parser.add_argument('subject')
+    usages_parser.add_argument('--file', help='file defining the subject, its dependants are searched')
+    usages_parser.set_defaults(run=usages)
+
+    dependants_parser = commands.add_parser('dependants', parents=[common], help='list the files depending on a file')
+    dependants_parser.add_argument('file')
+    dependants_parser.set_defaults(run=dependants)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
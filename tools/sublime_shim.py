@@ -0,0 +1,171 @@
+"""
+Minimal stand-in for the `sublime` and `sublime_plugin` modules so that the
+package can be imported and driven outside of Sublime Text.
+
+Only the parts of the API the package uses are implemented. Timeouts run
+immediately on the calling thread.
+"""
+import importlib
+import importlib.util
+import os
+import sys
+import tempfile
+import types
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRANSIENT = 4
+HIDDEN = 128
+
+class Region:
+
+    def __init__(self, a, b = None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and (self.a, self.b) == (other.a, other.b)
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __repr__(self):
+        return 'Region(%d, %d)' % (self.a, self.b)
+
+class Settings:
+
+    def __init__(self, values = None):
+        self.values = dict(values or {})
+        self.callbacks = {}
+
+    def get(self, name, default = None):
+        return self.values.get(name, default)
+
+    def set(self, name, value):
+        self.values[name] = value
+        for callback in list(self.callbacks.values()):
+            callback()
+
+    def has(self, name):
+        return name in self.values
+
+    def add_on_change(self, key, callback):
+        self.callbacks[key] = callback
+
+    def clear_on_change(self, key):
+        self.callbacks.pop(key, None)
+
+class View:
+
+    def __init__(self, window):
+        self._window = window
+        self.status = {}
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return None
+
+    def set_status(self, key, value):
+        self.status[key] = value
+
+    def erase_status(self, key):
+        self.status.pop(key, None)
+
+class Window:
+
+    def __init__(self, project_name, folders):
+        self.project_name = project_name
+        self._folders = list(folders)
+        self.messages = []
+        self.view = View(self)
+
+    def folders(self):
+        return list(self._folders)
+
+    def extract_variables(self):
+        return {'project_base_name': self.project_name}
+
+    def active_view(self):
+        return self.view
+
+    def views(self):
+        return []
+
+    def status_message(self, message):
+        self.messages.append(message)
+
+    def run_command(self, name, args = None):
+        pass
+
+    def show_quick_panel(self, items, on_select, flags = 0, selected_index = -1, on_highlight = None):
+        pass
+
+class State:
+    settings = Settings()
+    cache_dir = None
+    windows = []
+
+def configure(settings = None, project_name = 'project', folders = (), cache_dir = None):
+    """(Re)configure the fake editor: settings, a single project window and the cache directory"""
+    State.settings = Settings(settings)
+    State.windows = [Window(project_name, folders)]
+    State.cache_dir = cache_dir or State.cache_dir or tempfile.mkdtemp(prefix='gotousage-cache-')
+
+def make_sublime_module():
+    sublime = types.ModuleType('sublime')
+    sublime.TRANSIENT = TRANSIENT
+    sublime.HIDDEN = HIDDEN
+    sublime.Region = Region
+    sublime.Settings = Settings
+    sublime.load_settings = lambda name: State.settings
+    sublime.cache_path = lambda: State.cache_dir
+    sublime.windows = lambda: list(State.windows)
+    sublime.active_window = lambda: State.windows[0]
+    sublime.status_message = lambda message: State.windows[0].status_message(message)
+    sublime.set_timeout = lambda fn, delay = 0: fn()
+    sublime.set_timeout_async = lambda fn, delay = 0: fn()
+    sublime.version = lambda: '4000'
+    sublime.platform = lambda: sys.platform
+    return sublime
+
+def make_sublime_plugin_module():
+    sublime_plugin = types.ModuleType('sublime_plugin')
+    for name in ['EventListener', 'ViewEventListener', 'TextCommand', 'WindowCommand', 'ApplicationCommand']:
+        setattr(sublime_plugin, name, type(name, (object,), {}))
+    return sublime_plugin
+
+def install():
+    """Register the stand-in modules unless the real ones are available"""
+    if 'sublime' not in sys.modules:
+        sys.modules['sublime'] = make_sublime_module()
+        sys.modules['sublime_plugin'] = make_sublime_plugin_module()
+    if State.cache_dir is None:
+        configure()
+
+def load_package(name = 'GotoUsage'):
+    """
+    Install the stand-ins and import the package from the repository root.
+    Returns the package module with `core`, `utils`, `lexer` and `dep_graph` loaded.
+    """
+    install()
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_ROOT, '__init__.py'),
+            submodule_search_locations=[PACKAGE_ROOT])
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[name] = package
+        spec.loader.exec_module(package)
+    package = sys.modules[name]
+    for module in ['dep_graph', 'lexer', 'utils', 'core']:
+        setattr(package, module, importlib.import_module('%s.%s' % (name, module)))
+    return package
@@ -0,0 +1,93 @@
+"""
+Generator for synthetic JavaScript/CoffeeScript projects to benchmark against.
+
+Every module defines one class named after it and imports `fan_out` earlier
+modules (so the import graph is mostly acyclic), plus `cycles` extra imports
+from earlier modules to later ones that close import cycles. Bodies use the
+imported classes in code, comments and strings according to `comment_density`.
+"""
+import os
+import random
+
+def module_name(i):
+    return 'Module%04d' % i
+
+def module_path(root, i, files_per_dir):
+    "Modules are spread over dirN/subN directories, `files_per_dir` per directory"
+    d = i // files_per_dir
+    return os.path.join(root, 'src', 'dir%d' % (d // 10), 'sub%d' % (d % 10), 'module_%04d' % i)
+
+def import_path(from_path, to_path):
+    path = os.path.relpath(to_path, os.path.dirname(from_path))
+    return path if path.startswith('.') else './' + path
+
+def js_module(i, imports, comment_density, body_lines, rnd):
+    lines = []
+    for (j, path) in imports:
+        lines.append("import { %s } from '%s';" % (module_name(j), path))
+    lines.append('')
+    lines.append('export class %s {' % module_name(i))
+    for n in range(body_lines):
+        used = module_name(rnd.choice(imports)[0]) if imports else 'this'
+        roll = rnd.random()
+        if roll < comment_density / 2:
+            lines.append('  // TODO: stop depending on %s here' % used)
+        elif roll < comment_density:
+            lines.append('  /*')
+            lines.append('   * %s.create() used to live here' % used)
+            lines.append('   */')
+        elif roll < comment_density + 0.1:
+            lines.append('  label%d() { return "%s" + \'%d\' }' % (n, used, n))
+        else:
+            lines.append('  method%d(value) { return new %s(value).run(%d, `${value}`) }' % (n, used, n))
+    lines.append('}')
+    lines.append('')
+    lines.append('export const instance%d = new %s();' % (i, module_name(i)))
+    return '\n'.join(lines) + '\n'
+
+def coffee_module(i, imports, comment_density, body_lines, rnd):
+    lines = []
+    for (j, path) in imports:
+        lines.append("%s = require '%s'" % (module_name(j), path))
+    lines.append('')
+    lines.append('class %s' % module_name(i))
+    for n in range(body_lines):
+        used = module_name(rnd.choice(imports)[0]) if imports else '@'
+        roll = rnd.random()
+        if roll < comment_density:
+            lines.append('  # TODO: stop depending on %s here' % used)
+        elif roll < comment_density + 0.1:
+            lines.append('  label%d: -> "%s" + \'%d\'' % (n, used, n))
+        else:
+            lines.append('  method%d: (value) -> new %s(value).run(%d)' % (n, used, n))
+    lines.append('')
+    lines.append('module.exports = %s' % module_name(i))
+    return '\n'.join(lines) + '\n'
+
+def generate_project(root, num_files = 500, fan_out = 5, comment_density = 0.2, cycles = 5,
+        coffee_ratio = 0.2, body_lines = 40, files_per_dir = 50, seed = 0):
+    """
+    Write a synthetic project to `root`.
+    Returns a list of {'path', 'name', 'imports'} dicts, one per module.
+    """
+    rnd = random.Random(seed)
+    is_coffee = [rnd.random() < coffee_ratio for i in range(num_files)]
+    paths = [module_path(root, i, files_per_dir) + ('.coffee' if is_coffee[i] else '.js') for i in range(num_files)]
+    imported = [rnd.sample(range(i), min(i, fan_out)) for i in range(num_files)]
+    for n in range(min(cycles, num_files - 1)):
+        i = rnd.randrange(0, num_files - 1)
+        imported[i].append(rnd.randrange(i + 1, num_files))
+
+    modules = []
+    for i in range(num_files):
+        imports = [(j, import_path(paths[i], paths[j])[:-len(os.path.splitext(paths[j])[1])]) for j in imported[i]]
+        render = coffee_module if is_coffee[i] else js_module
+        os.makedirs(os.path.dirname(paths[i]), exist_ok=True)
+        with open(paths[i], 'w', encoding='utf8') as f:
+            f.write(render(i, imports, comment_density, body_lines, rnd))
+        modules.append({
+            'path': paths[i],
+            'name': module_name(i),
+            'imports': [paths[j] for j in imported[i]]
+        })
+    return modules
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import threading
+
+INDEX_VERSION = 3
+
+# Rough CPython costs in bytes, used to estimate the memory held by an index
+FILE_BYTES = 600 # Entry, stat and postings dicts of a file
+SUBJECT_BYTES = 150 # Postings list and the entries in the file's and the inverted map
+POSTING_BYTES = 40 # A line_nr and an offset in a flat postings list
+
+class UsageIndex:
+    """
+    Persistent inverted identifier index.
+    Maps identifier -> file -> usage postings.
+
+    Postings are stored per file so that a single file can be replaced cheaply
+    whenever it changes, as flat [line_nr, offset, line_nr, offset, ...] lists to keep
+    them small. The inverted identifier -> files map is kept in memory only and rebuilt
+    from the per-file postings on load.
+
+    The files changed since the index was last saved are tracked so that saving only
+    has to write those, see `take_changes`. Files open in the editor are checked for
+    freshness once per change of their buffer, see `is_fresh`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.files = {}
+        self.inverted = {}
+        self.num_subjects = 0
+        self.num_postings = 0
+        self.changed = set()
+        self.buffer_keys = {}
+
+    @property
+    def dirty(self):
+        return bool(self.changed)
+
+    def set_file(self, path, postings, stat = None, buffer_key = None):
+        """
+        Replace all postings of `path` ({identifier: [[line_nr, offset], ...]}), recording its
+        stat for freshness checks, preferably with the content hash (see `check_stat`), and the
+        key of the editor buffer it was indexed from if any
+        """
+        if stat is None:
+            try:
+                stat = file_stat(path)
+            except OSError:
+                self.remove_file(path)
+                return
+        postings = {subject: [n for pair in pairs for n in pair] for (subject, pairs) in postings.items()}
+        with self.lock:
+            self._remove_file(path)
+            self._add_file(path, postings, stat)
+            if buffer_key is not None: self.buffer_keys[path] = buffer_key
+
+    def remove_file(self, path):
+        with self.lock:
+            self._remove_file(path)
+
+    def _add_file(self, path, postings, stat):
+        self.files[path] = {
+            'stat': stat,
+            'postings': postings
+        }
+        for subject in postings:
+            if subject not in self.inverted:
+                self.inverted[subject] = set()
+            self.inverted[subject].add(path)
+            self.num_postings += len(postings[subject]) // 2
+        self.num_subjects += len(postings)
+        self.changed.add(path)
+
+    def _remove_file(self, path):
+        self.buffer_keys.pop(path, None)
+        entry = self.files.pop(path, None)
+        if not entry: return
+        self.num_subjects -= len(entry['postings'])
+        for subject in entry['postings']:
+            self.num_postings -= len(entry['postings'][subject]) // 2
+            paths = self.inverted.get(subject)
+            if not paths: continue
+            paths.discard(path)
+            if not paths: del self.inverted[subject]
+        self.changed.add(path)
+
+    def has_file(self, path):
+        return path in self.files
+
+    def is_fresh(self, path, buffer_key = None):
+        """
+        Return True if `path` is indexed and hasn't changed on disk since.
+        Files with a new mtime but the same contents stay fresh and are marked changed
+        so that the new mtime gets saved. Files open in the editor without unsaved changes
+        pass the `buffer_key` identifying the buffer's contents and aren't checked on disk
+        again until it changes.
+        """
+        entry = self.files.get(path)
+        if not entry: return False
+        if buffer_key is not None and self.buffer_keys.get(path) == buffer_key: return True
+        try:
+            stat = check_stat(path, entry['stat'])
+        except OSError:
+            return False
+        if stat is None: return False
+        with self.lock:
+            if stat is not entry['stat']:
+                entry['stat'] = stat
+                self.changed.add(path)
+            if buffer_key is not None: self.buffer_keys[path] = buffer_key
+        return True
+
+    def get_files(self, subject):
+        return self.inverted.get(subject, set())
+
+    def get_postings(self, subject, path):
+        """Return the usages of `subject` in `path` as [(line_nr, offset), ...]"""
+        entry = self.files.get(path)
+        if not entry: return []
+        postings = entry['postings'].get(subject, ())
+        return list(zip(postings[::2], postings[1::2]))
+
+    def memory_size(self):
+        """Estimate the memory held by the index in bytes"""
+        return len(self.files) * FILE_BYTES + self.num_subjects * SUBJECT_BYTES + self.num_postings * POSTING_BYTES
+
+    def get_data(self):
+        """Return a copy of the whole index to save, marking it as saved"""
+        with self.lock:
+            self.changed.clear()
+            return {
+                'version': INDEX_VERSION,
+                'files': dict(self.files)
+            }
+
+    def set_data(self, data):
+        self.clear()
+        if data.get('version') != INDEX_VERSION: return # Re-indexed lazily
+        with self.lock:
+            for path, entry in data.get('files', {}).items():
+                self._add_file(path, entry['postings'], entry['stat'])
+            self.changed.clear()
+
+    def take_changes(self):
+        """
+        Return the files changed since the index was last saved as journal records
+        ({"path", "stat", "postings"} or {"path", "removed": true}), marking them as saved
+        """
+        with self.lock:
+            records = []
+            for path in sorted(self.changed):
+                entry = self.files.get(path)
+                if entry is None:
+                    records.append({'path': path, 'removed': True})
+                else:
+                    records.append({'path': path, 'stat': entry['stat'], 'postings': entry['postings']})
+            self.changed.clear()
+            return records
+
+    def apply_record(self, record):
+        """Apply a record of `take_changes`, e.g. when replaying a journal"""
+        with self.lock:
+            self._remove_file(record['path'])
+            if not record.get('removed'):
+                self._add_file(record['path'], record['postings'], record['stat'])
+            self.changed.discard(record['path'])
+
+def file_stat(path):
+    "Return the [mtime, size] pair used to detect changed files"
+    st = os.stat(path)
+    return [st.st_mtime, st.st_size]
+
+def content_hash(data):
+    "Return a 64-bit hash of the raw contents of a file"
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+def check_stat(path, recorded):
+    """
+    Compare `path` against the [mtime, size, hash] (or older [mtime, size]) entry `recorded` for it.
+    Returns None if the file changed, else the entry to record from now on: `recorded` itself, or
+    an entry with the new mtime when only the mtime differs and the contents hash the same, as
+    after a fresh checkout of a project whose cache was built elsewhere.
+    """
+    if not recorded: return None
+    stat = file_stat(path)
+    if stat == recorded[:2]: return recorded
+    if len(recorded) < 3 or stat[1] != recorded[1]: return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) != stat[1] or content_hash(data) != recorded[2]: return None
+    return stat + [recorded[2]]
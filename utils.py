@@ -2,7 +2,13 @@ import os
 import re
 import sublime
 import json
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from . import graph_cache
+from . import stats
 from .dep_graph import DepGraph
+from .usage_index import UsageIndex
 
 STRING_DELIMITERS = ['"', "'", '`']
 
@@ -14,6 +20,58 @@ def infinite(max_iterations = 200):
         i += 1
     raise Exception("Infinite loop protection kicked in (i=%d). Something's buggy" % i)
 
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with a budget.
+    `sizeof` returns the cost of a value; the least recently used values are evicted
+    once the total cost exceeds the budget.
+    """
+
+    def __init__(self, budget, sizeof = lambda value: 1):
+        self.budget = budget
+        self.sizeof = sizeof
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key not in self.entries: return default
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            self._remove(key)
+            if size > self.budget: return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.budget:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def values(self):
+        with self.lock:
+            return [value for (value, size) in self.entries.values()]
+
+    def resize(self, budget):
+        """Change the budget, evicting the least recently used values that no longer fit"""
+        with self.lock:
+            self.budget = budget
+            while self.size > self.budget:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry: self.size -= entry[1]
+
 def get_current_line(view):
     "Returns the first highlighted line region and line contents"
     line_region = view.line(view.sel()[0])
@@ -85,32 +143,108 @@ def get_all_project_names():
     project_names = [v.get('project_base_name') for v in varses]
     return project_names
 
-def get_setting(name, default = None):
+def get_project_folders(project_name):
+    "Return the folders of the first open window with the given project"
+    for window in sublime.windows():
+        if window.extract_variables().get('project_base_name') == project_name:
+            return window.folders()
+    return []
+
+class ProjectSettings:
+    """
+    Resolved settings of a single project with precompiled path filters.
+    Values are resolved once and never change afterwards so a snapshot can be
+    shared between threads. Snapshots are dropped when the settings change.
+    """
+
+    def __init__(self, project_name):
+        self.project_name = project_name
+        self.settings = sublime.load_settings('GotoUsage.sublime-settings')
+        self.project_settings = self.settings.get(project_name or 'no_project', {})
+        self.values = {}
+        self.extensions = tuple(self.get('file_extensions', []))
+        excluded_folders = self.get('excluded_folders', [])
+        self.excluded_re = excluded_folders and re.compile('|'.join(re.escape(exc) for exc in excluded_folders))
+
+    def get(self, name, default = None):
+        if name not in self.values:
+            self.values[name] = self.project_settings.get(name, self.settings.get(name))
+        value = self.values[name]
+        return default if value is None else value
+
+    def file_filter(self, file_name):
+        """Return True if the file passes the filter."""
+        if not self.extensions: return True
+        return file_name.endswith(self.extensions)
+
+    def folder_filter(self, folder_name):
+        """Return True if the folder passes the filter."""
+        if not self.excluded_re: return True
+        return not self.excluded_re.search(folder_name.rstrip(os.sep) + os.sep)
+
+settings_snapshots = {}
+
+def get_settings(project_name = None):
+    "Return the settings snapshot of a project (the active one by default)"
+    if project_name is None:
+        project_name = get_active_project_name()
+    snapshot = settings_snapshots.get(project_name)
+    if snapshot is None:
+        snapshot = settings_snapshots[project_name] = ProjectSettings(project_name)
+    return snapshot
+
+def clear_settings():
+    settings_snapshots.clear()
+
+def configure_stats():
     settings = sublime.load_settings('GotoUsage.sublime-settings')
-    project_settings = settings.get(get_active_project_name() or 'no_project', {})
-    return project_settings.get(name, settings.get(name, default))
+    stats.configure(settings.get('collect_stats', False), settings.get('stats_history', 50))
+
+# Called after the settings snapshots are dropped, see `watch_settings`
+settings_listeners = []
+
+def on_settings_changed():
+    clear_settings()
+    configure_stats()
+    for listener in settings_listeners:
+        listener()
+
+def watch_settings(listeners = ()):
+    "Drop all settings snapshots whenever the settings file changes, then call `listeners`"
+    settings_listeners[:] = listeners
+    configure_stats()
+    sublime.load_settings('GotoUsage.sublime-settings').add_on_change('GotoUsage', on_settings_changed)
+
+def unwatch_settings():
+    sublime.load_settings('GotoUsage.sublime-settings').clear_on_change('GotoUsage')
+
+def get_setting(name, default = None, project_name = None):
+    return get_settings(project_name).get(name, default)
 
 def log(*args, **kwargs):
+    """
+    Print errors and warnings, other messages only with `verbose_logging`. Pass the `settings`
+    snapshot or the `project_name` of the project at hand when there is one so that the active
+    project isn't looked up.
+    """
     error = kwargs.get('error', False)
     warning = kwargs.get('warning', False)
-    if get_setting('verbose_logging') or error or warning:
-        print('GotoUsage%s:' % (error and ' Error' or warning and ' Warning' or ''), *args)
+    if not error and not warning:
+        settings = kwargs.get('settings') or get_settings(kwargs.get('project_name'))
+        if not settings.get('verbose_logging'): return
+    print('GotoUsage%s:' % (error and ' Error' or warning and ' Warning' or ''), *args)
 
 def file_filter(file_name):
-    """Return True if the file passes the filter."""
-    extensions = get_setting('file_extensions', [])
-    if not extensions: return True
-    return True in [file_name.endswith(ext) for ext in extensions]
+    """Return True if the file passes the filter of the active project."""
+    return get_settings().file_filter(file_name)
 
 def folder_filter(folder_name):
-    """Return True if the folder passes the filter."""
-    excluded_folders = get_setting('excluded_folders', [])
-    folder_name = folder_name.rstrip(os.sep) + os.sep
-    return True not in [exc in folder_name for exc in excluded_folders]
+    """Return True if the folder passes the filter of the active project."""
+    return get_settings().folder_filter(folder_name)
 
-def expand_aliases(paths):
+def expand_aliases(paths, settings = None):
     "Replace all aliases in paths with the actual path"
-    aliases = get_setting('alias', {})
+    aliases = (settings or get_settings()).get('alias', {})
     for alias, alias_path in aliases.items():
         for i in range(len(paths)):
             if not paths[i].startswith(alias): continue
@@ -144,64 +278,334 @@ def get_cache_dir():
     return path
 
 def get_dep_cache_path(project_name):
+    return os.path.join(get_cache_dir(), '%s-cache.bin' % project_name)
+
+def get_dep_journal_path(project_name):
+    return os.path.join(get_cache_dir(), '%s-cache.journal' % project_name)
+
+def get_legacy_dep_cache_path(project_name):
     return os.path.join(get_cache_dir(), '%s-cache.json' % project_name)
 
+JOURNAL_COMPACT_THRESHOLD = 500
+
+journal_lengths = {}
+journal_locks = {}
+compacting = set() # Journals whose snapshot is being written in the background
+snapshot_generations = {}
+snapshot_locks = {}
+def get_journal_lock(project_name):
+    return journal_locks.setdefault(project_name, threading.Lock())
+
+def next_snapshot_generation(name):
+    "Number a snapshot taken of `name` (a journal lock name). Call with the journal's lock held"
+    snapshot_generations[name] = snapshot_generations.get(name, 0) + 1
+    return snapshot_generations[name]
+
+def write_snapshot_unless_stale(name, generation, write, journal_path):
+    """
+    Call `write()` to write the `generation` snapshot of `name` unless a newer one was taken
+    meanwhile, then remove the journal moved aside for it. Writes are serialized per name, so
+    a background compaction never replaces a newer snapshot or mixes its output with it.
+    The journal moved aside is left to the newest snapshot, which holds all of its records.
+    Returns False if the snapshot was skipped as stale.
+    """
+    with snapshot_locks.setdefault(name, threading.Lock()):
+        with get_journal_lock(name):
+            if generation != snapshot_generations.get(name): return False
+        write()
+        with get_journal_lock(name):
+            if generation == snapshot_generations.get(name): remove_old_journal(journal_path)
+    return True
+
+def rotate_journal(path):
+    """
+    Move a journal aside (to `path`.old) while it's being compacted so that changes saved
+    meanwhile go to a new journal. The old journal is removed by `remove_old_journal` once the
+    new snapshot is written; until then loading replays both. Call with the journal's lock held.
+    """
+    old_path = path + '.old'
+    if not os.path.exists(path): return
+    if os.path.exists(old_path):
+        # A previous compaction didn't finish, keep its records too
+        with open(path, 'rb') as f, open(old_path, 'ab') as old:
+            old.write(f.read())
+        os.remove(path)
+    else:
+        os.replace(path, old_path)
+
+def remove_old_journal(path):
+    if os.path.exists(path + '.old'):
+        os.remove(path + '.old')
+
+def load_legacy_graph(project_name):
+    """Load a graph from the JSON cache used by older versions"""
+    path = get_legacy_dep_cache_path(project_name)
+    f = open(path, 'r', encoding='utf8')
+    data = json.loads(f.read())
+    f.close()
+    graph = DepGraph()
+    graph.set_data(data['graph'])
+    return {
+        'last_update': data['last_update'],
+        'graph': graph,
+        'manifest': data.get('manifest', {})
+    }
+
 def load_graph(project_name):
-    """Load graph from cache to `graph`"""
+    """Load graph from cache (snapshot + journal) to `graph`"""
     path = get_dep_cache_path(project_name)
-    log("Attempting to load graph for '%s' from %s" % (project_name, path))
-    try:
-        f = open(path, 'r', encoding='utf8')
-        data = json.loads(f.read())
-        f.close()
-        graph = DepGraph()
-        graph.set_data(data['graph'])
-        return {
-            'last_update': data['last_update'],
-            'graph': graph
-        }
-    except IOError:
-        return None
+    log("Attempting to load graph for '%s' from %s" % (project_name, path), project_name=project_name)
+    with get_journal_lock(project_name):
+        try:
+            graph = DepGraph()
+            (last_update, manifest) = graph_cache.read_snapshot(path, graph)
+            g = {
+                'last_update': last_update,
+                'graph': graph,
+                'manifest': manifest
+            }
+        except (IOError, ValueError):
+            try:
+                return load_legacy_graph(project_name)
+            except (IOError, ValueError):
+                return None
+        journal_path = get_dep_journal_path(project_name)
+        # A journal moved aside for a compaction that didn't finish comes first
+        journal_lengths[project_name] = sum(graph_cache.replay_journal(replay_path, g)
+            for replay_path in [journal_path + '.old', journal_path])
+    return g
 
 def save_graph(g, project_name):
-    """Save current graph to cache"""
+    """Save current graph to cache as a new snapshot, emptying the journal"""
+    with get_journal_lock(project_name):
+        snapshot = graph_cache.take_snapshot(g)
+        generation = next_snapshot_generation(project_name)
+        rotate_journal(get_dep_journal_path(project_name))
+        journal_lengths[project_name] = 0
+    write_graph_snapshot(snapshot, project_name, generation)
+
+def write_graph_snapshot(snapshot, project_name, generation, compaction = False):
     path = get_dep_cache_path(project_name)
-    log("Saving graph for '%s' to cache: %s" % (project_name, path))
+    log("Saving graph for '%s' to cache: %s" % (project_name, path), project_name=project_name)
     try:
-        f = open(path, 'w')
-        data = {
-            'last_update': g['last_update'],
-            'graph': g['graph'].get_data()
-        }
-        f.write(json.dumps(data, separators=(',',':')))
-        f.close()
+        # Only once the snapshot holds them the journaled changes can go
+        write_snapshot_unless_stale(project_name, generation, lambda: graph_cache.write_snapshot(path, snapshot),
+            get_dep_journal_path(project_name))
     except IOError as e:
-        log("Failed to save dependency graph: %s" % e.message, error=True)
+        log("Failed to save dependency graph: %s" % e, error=True)
+    if compaction: compacting.discard(project_name)
 
-def clear_caches():
+def save_graph_changes(g, project_name, file_paths):
+    """
+    Save the current state of `file_paths` to the cache by appending to the journal.
+    The journal is compacted into a new snapshot in the background once it grows large.
+    """
+    path = get_dep_journal_path(project_name)
+    records = [graph_cache.make_record(g, file_path, g['last_update']) for file_path in file_paths]
+    with get_journal_lock(project_name):
+        try:
+            graph_cache.append_journal(path, records)
+        except IOError as e:
+            log("Failed to save dependency graph changes: %s" % e, error=True)
+            return
+        journal_lengths[project_name] = journal_lengths.get(project_name, 0) + len(records)
+        if journal_lengths[project_name] < JOURNAL_COMPACT_THRESHOLD or project_name in compacting: return
+        # The graph is copied and the journal moved aside here, the snapshot is written in the background
+        compacting.add(project_name)
+        snapshot = graph_cache.take_snapshot(g)
+        generation = next_snapshot_generation(project_name)
+        rotate_journal(path)
+        journal_lengths[project_name] = 0
+    log("Compacting graph journal for '%s'" % project_name, project_name=project_name)
+    threading.Thread(target=write_graph_snapshot, args=[snapshot, project_name, generation, True]).start()
+
+def get_index_cache_path(project_name):
+    return os.path.join(get_cache_dir(), '%s-index.json' % project_name)
+
+def get_index_journal_path(project_name):
+    return os.path.join(get_cache_dir(), '%s-index.journal' % project_name)
+
+def get_index_lock_name(project_name):
+    return '%s-index' % project_name
+
+def load_index(project_name):
+    """Load the usage index of a project from cache (snapshot + journal)"""
+    path = get_index_cache_path(project_name)
+    log("Attempting to load usage index for '%s' from %s" % (project_name, path), project_name=project_name)
+    with get_journal_lock(get_index_lock_name(project_name)):
+        try:
+            f = open(path, 'r', encoding='utf8')
+            data = json.loads(f.read())
+            f.close()
+        except (IOError, ValueError):
+            return None
+        index = UsageIndex()
+        index.set_data(data)
+        journal_path = get_index_journal_path(project_name)
+        num_records = 0
+        for replay_path in [journal_path + '.old', journal_path]:
+            num_records += replay_index_journal(replay_path, index)
+        journal_lengths[get_index_lock_name(project_name)] = num_records
+    return index
+
+def replay_index_journal(path, index):
+    "Apply the records of an index journal, returns the number of records applied"
+    try:
+        f = open(path, 'r', encoding='utf8')
+    except IOError:
+        return 0
+    num_records = 0
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break # Partially written last record
+            index.apply_record(record)
+            num_records += 1
+    return num_records
+
+def save_index(index, project_name):
+    """Save the whole usage index of a project to cache as a new snapshot, emptying the journal"""
+    lock_name = get_index_lock_name(project_name)
+    with get_journal_lock(lock_name):
+        data = index.get_data()
+        generation = next_snapshot_generation(lock_name)
+        rotate_journal(get_index_journal_path(project_name))
+        journal_lengths[lock_name] = 0
+    write_index_snapshot(data, project_name, generation)
+
+def write_index_snapshot(data, project_name, generation, compaction = False):
+    path = get_index_cache_path(project_name)
+    log("Saving usage index for '%s' to cache: %s" % (project_name, path), project_name=project_name)
+    try:
+        write = lambda: graph_cache.write_atomically(path, [json.dumps(data, separators=(',',':')).encode('utf8')])
+        write_snapshot_unless_stale(get_index_lock_name(project_name), generation, write, get_index_journal_path(project_name))
+    except IOError as e:
+        log("Failed to save usage index: %s" % e, error=True)
+    if compaction: compacting.discard(get_index_lock_name(project_name))
+
+def save_index_changes(index, project_name):
+    """
+    Save the files (re)indexed since the last save by appending them to the index journal.
+    The journal is compacted into a new snapshot in the background once it grows large.
+    """
+    lock_name = get_index_lock_name(project_name)
+    with get_journal_lock(lock_name):
+        records = index.take_changes()
+        if not records: return
+        try:
+            graph_cache.append_journal(get_index_journal_path(project_name), records)
+        except IOError as e:
+            log("Failed to save usage index changes: %s" % e, error=True)
+            return
+        journal_lengths[lock_name] = journal_lengths.get(lock_name, 0) + len(records)
+        if journal_lengths[lock_name] < JOURNAL_COMPACT_THRESHOLD or lock_name in compacting: return
+        # The index is copied and the journal moved aside here, the snapshot is written in the background
+        compacting.add(lock_name)
+        data = index.get_data()
+        generation = next_snapshot_generation(lock_name)
+        rotate_journal(get_index_journal_path(project_name))
+        journal_lengths[lock_name] = 0
+    log("Compacting usage index journal for '%s'" % project_name, project_name=project_name)
+    threading.Thread(target=write_index_snapshot, args=[data, project_name, generation, True]).start()
+
+def clear_caches(settings = None):
     files = get_files_in_dir(get_cache_dir())
     for file_path in files:
         (parent_dir, file_name) = os.path.split(file_path)
-        log("Removing cache file %s" % file_path)
+        log("Removing cache file %s" % file_path, settings=settings)
         os.remove(file_path)
 
-isfile_cache = {}
-def isfile(path):
-    """Memoized version of os.path.isfile"""
-    global isfile_cache
-    if path not in isfile_cache:
-        isfile_cache[path] = os.path.isfile(path)
-    return isfile_cache[path]
-
-isdir_cache = {}
-def isdir(path):
-    """Memoized version of os.path.isdir"""
-    global isdir_cache
-    if path not in isdir_cache:
-        isdir_cache[path] = os.path.isdir(path)
-    return isdir_cache[path]
-
-def resolve_dep_paths(paths, from_path, file_filter_fn = lambda x: True, folder_filter_fn = lambda x: True):
+class DirIndex:
+    """
+    Directory listings for import resolution, each read once with os.scandir.
+    A listing holds the sorted file names of a directory (so that prefix matching
+    is a bisect) and the names of its sub-directories.
+
+    A build creates its own index and trusts it for the build's duration. The long-lived
+    index shared between saves (`validate=True`) re-reads a listing whenever the directory's
+    mtime changed and keeps at most `max_dirs` listings.
+    """
+
+    def __init__(self, validate = False, max_dirs = None):
+        self.validate = validate
+        self.listings = LRUCache(max_dirs) if max_dirs else {}
+
+    def clear(self):
+        self.listings.clear()
+
+    def get_listing(self, path):
+        """Return (mtime, files, file_set, dirs, links) for directory `path` or None if it isn't one"""
+        listing = self.listings.get(path)
+        if listing is not None and not self.validate: return listing
+        try:
+            mtime = os.stat(path).st_mtime
+            if listing is not None and listing[0] == mtime: return listing
+            files = []
+            dirs = set()
+            links = set()
+            for entry in os.scandir(path):
+                if entry.is_dir():
+                    dirs.add(entry.name)
+                    if entry.is_symlink(): links.add(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+        except OSError:
+            listing = (None, [], frozenset(), frozenset(), frozenset())
+        else:
+            files.sort()
+            listing = (mtime, files, frozenset(files), frozenset(dirs), frozenset(links))
+        if isinstance(self.listings, LRUCache):
+            self.listings.set(path, listing)
+        else:
+            self.listings[path] = listing
+        return listing if listing[0] is not None else None
+
+    def isfile(self, path):
+        (parent_dir, name) = os.path.split(path)
+        listing = self.get_listing(parent_dir)
+        return bool(listing) and name in listing[2]
+
+    def isdir(self, path):
+        (parent_dir, name) = os.path.split(path.rstrip(os.sep))
+        if not name: return self.get_listing(path) is not None
+        listing = self.get_listing(parent_dir)
+        return bool(listing) and name in listing[3]
+
+    def get_files(self, path):
+        "Return the paths of all files directly within directory `path`"
+        listing = self.get_listing(path)
+        if not listing: return []
+        return [os.path.join(path, f) for f in listing[1]]
+
+    def get_files_with_prefix(self, path, prefix):
+        "Return the paths of the files directly within directory `path` whose name starts with `prefix`"
+        listing = self.get_listing(path)
+        if not listing: return []
+        files = listing[1]
+        matches = []
+        for i in range(bisect_left(files, prefix), len(files)):
+            if not files[i].startswith(prefix): break
+            matches.append(os.path.join(path, files[i]))
+        return matches
+
+    def walk(self, folder):
+        "Like os.walk (top-down, not following links) but filling the index along the way"
+        listing = self.get_listing(folder)
+        if not listing: return
+        dirs = sorted(d for d in listing[3] if d not in listing[4])
+        yield (folder, dirs, list(listing[1]))
+        for d in dirs:
+            for result in self.walk(os.path.join(folder, d)):
+                yield result
+
+DIR_INDEX_MAX_DIRS = 10000
+
+# Listings shared between single-file refreshes, kept fresh by comparing directory mtimes
+shared_dir_index = DirIndex(validate=True, max_dirs=DIR_INDEX_MAX_DIRS)
+
+def resolve_dep_paths(paths, from_path, file_filter_fn = lambda x: True, folder_filter_fn = lambda x: True, settings = None, dir_index = None):
     """
     Try to fix all paths that don't appear to point to actual files.
 
@@ -211,6 +615,7 @@ def resolve_dep_paths(paths, from_path, file_filter_fn = lambda x: True, folder_
     Paths that still can't be resolved to anything => ignore dat shit (must be some lib import)
     """
     resolved_paths = []
+    dir_index = dir_index or shared_dir_index
 
     def add_path(path):
         resolved_paths.append(path)
@@ -222,27 +627,26 @@ def resolve_dep_paths(paths, from_path, file_filter_fn = lambda x: True, folder_
         """
 
         # Add file path
-        if isfile(path):
+        if dir_index.isfile(path):
             if not file_filter_fn(path): return (True, False)
             if not folder_filter_fn(os.path.split(path)[0]): return (True, False)
             add_path(path)
             return (True, True)
 
         # Add files in dir
-        if isdir(path):
+        if dir_index.isdir(path):
             if not folder_filter_fn(path): return (True, False)
-            file_paths = [f for f in get_files_in_dir(path, False)]
+            file_paths = dir_index.get_files(path)
             file_paths_filtered = [f for f in file_paths if file_filter_fn(f)]
             if not len(file_paths_filtered): return [len(file_paths) > 0, False]
             for file_path in file_paths_filtered:
-                add_path(os.path.join(path, file_path))
+                add_path(file_path)
             return (True, True)
 
         # Add matching filenames
         (parent_dir, file_substr) = os.path.split(path.rstrip(os.sep))
-        all_files_in_dir = get_files_in_dir(parent_dir, False)
-        if not folder_filter_fn(parent_dir): return (len(all_files_in_dir) > 0, False)
-        matching_files_in_dir = [f for f in all_files_in_dir if os.path.basename(f).startswith(file_substr)]
+        if not folder_filter_fn(parent_dir): return (len(dir_index.get_files(parent_dir)) > 0, False)
+        matching_files_in_dir = dir_index.get_files_with_prefix(parent_dir, file_substr)
         matching_files_filtered = [f for f in matching_files_in_dir if file_filter_fn(f)]
 
         if not matching_files_filtered: return [len(matching_files_in_dir) > 0, False]
@@ -252,19 +656,22 @@ def resolve_dep_paths(paths, from_path, file_filter_fn = lambda x: True, folder_
 
         return (False, False)
 
+    settings = settings or get_settings()
+    stats.count('imports', len(paths))
     for path in paths:
-        roots = [from_path] + get_setting('root', [])
+        roots = [from_path] + settings.get('root', [])
         found_any_file = False
         for root in roots:
             full_path = join_dep_path(root, path)
             (found_file, passed_filter) = expand_path(full_path)
             if found_file and not passed_filter:
-                log("Found a dependency for path but ignoring due to file and folder filters: '%s'" % full_path)
+                log("Found a dependency for path but ignoring due to file and folder filters: '%s'" % full_path, settings=settings)
             found_any_file = found_any_file or found_file
             if found_file and passed_filter: break
 
         # Warn when file was not found and the reason wasn't filtering
         if not found_any_file:
+            stats.count('unresolved_imports')
             log("Could not resolve import %s. Did you forget to add an alias? (import from %s)" % (path, from_path), warning=True)
 
     return resolved_paths
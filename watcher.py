@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import deque
+from . import utils
+from .usage_index import check_stat
+
+watchers = {}
+
+def watch(project_name, folders, get_manifest, on_change):
+    """
+    Start watching the folders of a project in the background (if enabled).
+    `get_manifest()` returns the manifest of the project's graph to diff against and
+    `on_change(project_name, changed, removed)` receives batches of changed paths.
+    """
+    if not utils.get_setting('watch_folders', False, project_name) or not folders: return
+    current = watchers.get(project_name)
+    if current and current.is_alive(): return
+    watchers[project_name] = FolderWatcher(project_name, folders, get_manifest, on_change)
+    watchers[project_name].start()
+
+def unwatch(project_name):
+    folder_watcher = watchers.pop(project_name, None)
+    if folder_watcher: folder_watcher.stop()
+
+def unwatch_all():
+    for folder_watcher in watchers.values():
+        folder_watcher.stop()
+    watchers.clear()
+
+class FolderWatcher(threading.Thread):
+    """
+    Polls project folders for files that were changed outside of the editor.
+
+    Files are compared against the graph's manifest so saves from within the editor
+    aren't reported twice. Directory listings are only re-read when the directory's
+    mtime changes. Each poll does at most `watch_budget_ms` worth of work and the
+    next poll continues where the previous one stopped.
+    """
+
+    def __init__(self, project_name, folders, get_manifest, on_change):
+        super().__init__(name='GotoUsage watcher (%s)' % project_name)
+        self.daemon = True
+        self.project_name = project_name
+        self.folders = list(folders)
+        self.get_manifest = get_manifest
+        self.on_change = on_change
+        self.stopped = threading.Event()
+        self.listings = {}
+        self.queue = deque()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(utils.get_setting('watch_interval', 5, self.project_name)):
+            manifest = self.get_manifest()
+            if manifest is None: continue
+            settings = utils.get_settings(self.project_name)
+            (changed, removed) = self.poll(manifest, settings)
+            if changed or removed:
+                utils.log("Watcher found %d changed and %d removed files in %s" % (len(changed), len(removed), self.project_name),
+                    settings=settings)
+                self.on_change(self.project_name, changed, removed)
+
+    def poll(self, manifest, settings):
+        """Check directories until the `watch_budget_ms` budget is used up. Returns (changed, removed)"""
+        deadline = time.time() + settings.get('watch_budget_ms', 50) / 1000
+        changed = []
+        removed = []
+        if not self.queue: self.queue.extend(self.folders)
+        while self.queue and time.time() < deadline:
+            listing = self.list_dir(self.queue.popleft(), settings, removed)
+            if not listing: continue
+            (files, dirs) = listing
+            self.queue.extend(dirs)
+            for file_path in files:
+                try:
+                    recorded = manifest.get(file_path)
+                    stat = check_stat(file_path, recorded)
+                except OSError:
+                    continue
+                if stat is None:
+                    changed.append(file_path)
+                elif stat is not recorded:
+                    # Touched but unchanged, saved with the next snapshot
+                    manifest[file_path] = stat
+        return (changed, removed)
+
+    def list_dir(self, dir_path, settings, removed):
+        """
+        Return the (files, dirs) passing the filters in `dir_path`, re-using the previous listing
+        if the directory's mtime is unchanged. Files that disappeared are added to `removed`.
+        """
+        cached = self.listings.get(dir_path)
+        try:
+            mtime = os.stat(dir_path).st_mtime
+            if cached and cached[0] == mtime: return cached[1:]
+            files = []
+            dirs = []
+            for entry in os.scandir(dir_path):
+                if entry.name[0] == '.': continue
+                if entry.is_dir():
+                    if settings.folder_filter(entry.path): dirs.append(entry.path)
+                elif entry.is_file() and settings.file_filter(entry.name):
+                    files.append(entry.path)
+        except OSError:
+            self.forget(dir_path, removed)
+            return None
+
+        if cached:
+            removed.extend(set(cached[1]) - set(files))
+            for gone_dir in set(cached[2]) - set(dirs):
+                self.forget(gone_dir, removed)
+        self.listings[dir_path] = (mtime, files, dirs)
+        return (files, dirs)
+
+    def forget(self, dir_path, removed):
+        """Drop the listing of a removed directory, reporting all its files as removed"""
+        cached = self.listings.pop(dir_path, None)
+        if not cached: return
+        removed.extend(cached[1])
+        for sub_dir in cached[2]:
+            self.forget(sub_dir, removed)